@@ -0,0 +1,178 @@
+"""
+Benchmark for sort.py.
+
+Builds synthetic folders in a temp directory and sorts them, printing
+files/s, file system calls per file and peak memory, so runs before and
+after a change can be compared:
+
+    python bench_sort.py --files 20000 --repeat 3 --save bench.jsonl
+"""
+import argparse
+import builtins
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+import sort
+
+LATIN_WORDS = ('file', 'report', 'photo', 'song', 'clip', 'notes', 'a b', 'scan')
+CYRILLIC_WORDS = ('Фото', 'Документ', 'Звіт', 'Пісня', 'Відео', 'Щоденник', 'Їжак', "м’ята")
+EXTENSIONS = ('jpg', 'png', 'svg', 'mp4', 'avi', 'txt', 'pdf', 'docx', 'mp3', 'wav', 'xyz', '')
+# file system calls made from Python in this process, counted by wrapping
+# these; DirEntry methods and the unpacking processes are not counted
+COUNTED_CALLS = (
+    (os, 'stat'), (os, 'lstat'), (os, 'scandir'), (os, 'listdir'), (os, 'rename'), (os, 'replace'),
+    (os, 'remove'), (os, 'unlink'), (os, 'link'), (os, 'mkdir'), (os, 'rmdir'), (builtins, 'open'),
+)
+
+def make_tree(root, files=1000, depth=3, fanout=4, cyrillic=0.3, collisions=0.2, archives=0.02,
+              max_size=4096, seed=0):
+    """
+    Fill root with files spread over folders up to depth levels deep.
+
+    cyrillic, collisions and archives are the shares of files with a
+    Cyrillic name, with a name many other files share, and of small zip
+    archives.
+    """
+    rng = random.Random(seed)
+    folders = [root]
+    for level in range(depth):
+        folders += [os.path.join(rng.choice(folders), f"{rng.choice(CYRILLIC_WORDS + LATIN_WORDS)} {level}_{i}")
+                    for i in range(fanout ** (level + 1))]
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+
+    for i in range(files):
+        folder = rng.choice(folders)
+        word = rng.choice(CYRILLIC_WORDS if rng.random() < cyrillic else LATIN_WORDS)
+        name = word if rng.random() < collisions else f"{word}_{i}"
+        if rng.random() < archives:
+            with zipfile.ZipFile(unused_path(folder, name, 'zip'), 'w') as archive:
+                for member in range(3):
+                    archive.writestr(f"{word}_{member}.txt", 'x' * rng.randrange(max_size))
+            continue
+        with open(unused_path(folder, name, rng.choice(EXTENSIONS)), 'wb') as file:
+            file.write(rng.randbytes(rng.randrange(max_size)))
+
+def unused_path(folder, name, ext):
+    ext = '.' + ext if ext else ''
+    path = os.path.join(folder, name + ext)
+    counter = 1
+    while os.path.exists(path):
+        path = os.path.join(folder, f"{name} ({counter}){ext}")
+        counter += 1
+    return path
+
+@contextlib.contextmanager
+def count_calls():
+    """Count the COUNTED_CALLS made inside the block, by name."""
+    counts = dict.fromkeys((name for module, name in COUNTED_CALLS), 0)
+    originals = [(module, name, getattr(module, name)) for module, name in COUNTED_CALLS]
+
+    def counted(name, function):
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            return function(*args, **kwargs)
+        return wrapper
+
+    for module, name, function in originals:
+        setattr(module, name, counted(name, function))
+    try:
+        yield counts
+    finally:
+        for module, name, function in originals:
+            setattr(module, name, function)
+
+def sort_tree(root, options):
+    """Plan and sort root quietly, returning (planning seconds, sorting seconds)."""
+    categories = sort.Categories(sort.CATEGORIES)
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        plan = sort.plan_folder(root, options.unpack, options.dedup, options.workers, categories=categories)
+        planned = time.perf_counter()
+        sort.execute_plan(plan, options.workers)
+        return planned - started, time.perf_counter() - planned
+
+def run(options):
+    workdir = tempfile.mkdtemp(prefix='bench_sort_')
+    # hash caches and checkpoints of the throwaway trees go with them
+    sort.SORT_STATE_DIR = os.path.join(workdir, 'state')
+    tree_options = dict(files=options.files, depth=options.depth, fanout=options.fanout,
+                        cyrillic=options.cyrillic, collisions=options.collisions, archives=options.archives,
+                        seed=options.seed)
+    try:
+        timings = []
+        for repeat in range(options.repeat):
+            root = os.path.join(workdir, f"tree{repeat}")
+            make_tree(root, **tree_options)
+            timings.append(sort_tree(root, options))
+
+        # one more run for the counts, as counting and tracing slow it down
+        root = os.path.join(workdir, 'counted')
+        make_tree(root, **tree_options)
+        tracemalloc.start()
+        with count_calls() as counts:
+            sort_tree(root, options)
+        peak_python = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    total = statistics.median(plan + execute for plan, execute in timings)
+    result = {
+        'files': options.files,
+        'files_per_second': round(options.files / total),
+        'plan_seconds': round(statistics.median(plan for plan, execute in timings), 4),
+        'sort_seconds': round(statistics.median(execute for plan, execute in timings), 4),
+        'fs_calls_per_file': round(sum(counts.values()) / options.files, 2),
+        'fs_calls': {name: count for name, count in counts.items() if count},
+        'peak_python_mib': round(peak_python / 2 ** 20, 1),
+    }
+    if resource is not None:
+        # kilobytes on Linux, bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result['max_rss_mib'] = round(max_rss / (2 ** 20 if os.uname().sysname == 'Darwin' else 2 ** 10), 1)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sort.py on synthetic folders.")
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=4, help="subfolders per folder and level")
+    parser.add_argument('--cyrillic', type=float, default=0.3, help="share of Cyrillic names")
+    parser.add_argument('--collisions', type=float, default=0.2, help="share of names many files share")
+    parser.add_argument('--archives', type=float, default=0.02, help="share of zip archives")
+    parser.add_argument('--unpack', action='store_true', help="unpack the archives")
+    parser.add_argument('--dedup', choices=sort.DEDUP_MODES)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help="append the result as a JSON line to this file")
+    options = parser.parse_args()
+
+    result = run(options)
+    print(f"{result['files']} files: {result['files_per_second']} files/s "
+          f"(plan {result['plan_seconds']} s, sort {result['sort_seconds']} s), "
+          f"{result['fs_calls_per_file']} fs calls per file, "
+          f"peak Python memory {result['peak_python_mib']} MiB"
+          + (f", max RSS {result['max_rss_mib']} MiB" if 'max_rss_mib' in result else ''))
+    print('fs calls:', ', '.join(f"{name} {count}" for name, count in result['fs_calls'].items()))
+    if options.save:
+        with open(options.save, 'a', encoding='utf-8') as file:
+            file.write(json.dumps({**result, 'options': vars(options)}, ensure_ascii=False) + '\n')
+
+if __name__ == '__main__':
+    main()
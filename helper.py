@@ -1,7 +1,18 @@
-from datetime import datetime
+from datetime import datetime, date
+from bisect import bisect_left, bisect_right
 from collections import UserDict
+from collections.abc import MutableMapping
+from array import array
+from functools import lru_cache
+import csv
+import json
+import mmap
+import multiprocessing
 import pickle
-from sort import clean_folder_interface
+import struct
+import sys
+from sort import clean_folder_interface, transliterate
+from journal import Journal, pack_strings, unpack_strings
 from note import notebook_interface, Note
 import os
 import re #16.10.23 Olha
@@ -11,10 +22,111 @@ import re #16.10.23 Olha
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ADDRESS_BOOK_PATH = os.path.join(BASE_DIR, 'address_book.dat')
+
+# Journal of changes appended next to the address book snapshot
+JOURNAL_MAGIC = b'ABJ1'
+JOURNAL_PUT = 1
+JOURNAL_DELETE = 2
+
+# Columnar snapshot: header, column table, then every column as its data
+# followed by count + 1 offsets into that data, then the row numbers in
+# the order of their names, so a name can be bisected
+COLUMNAR_MAGIC = b'ABOOKCOL'
+COLUMNAR_VERSION = 1
+COLUMNAR_HEADER = struct.Struct('<8sHHI')  # magic, version, columns, records
+COLUMNAR_COLUMN = struct.Struct('<QQ')  # data position, offsets position
+COLUMN_NAMES, COLUMN_PHONES, COLUMN_EMAILS, COLUMN_BIRTHDAYS, COLUMN_NAME_ORDER = range(5)
+NAME_ORDER_ROW = struct.Struct('<I')
+BIRTHDAY_KEY = struct.Struct('<H')  # month * 100 + day, 0 when there is no birthday
+
+PAGE_SORTS = ('added', 'name', 'birthday')  # orders 'show all' can page through
+
+# Bulk import and export of contacts
+CONTACT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.vcf': 'vcard', '.vcard': 'vcard'}
+CSV_FIELDS = ('name', 'phones', 'emails', 'birthday')
+LIST_SEPARATOR = ';'  # between phones or emails in one CSV cell
+IMPORT_CHUNK_SIZE = 10000  # rows validated together
+
+# Phone and email validation
+EMAIL_PATTERN = re.compile(r'[A-Za-z][A-Za-z0-9._]+@[A-Za-z]+\.[A-Za-z]{2,}\b')
+
+# Duplicate search: keys shared by more contacts than this (an office
+# switchboard, an info@ mailbox) say nothing about who is a duplicate
+DEDUP_MAX_BLOCK = 50
+
+NGRAM_SIZE = 3  # longest substring kept in the search index
+
+
+def _ngrams(text):
+    """All substrings of text up to NGRAM_SIZE characters long."""
+    grams = set()
+    for size in range(1, NGRAM_SIZE + 1):
+        for i in range(len(text) - size + 1):
+            grams.add(text[i:i + size])
+    return grams
+
+
+@lru_cache(maxsize=65536)
+def _parse_birthday(value):
+    for date_format in ("%d.%m.%y", "%d-%m-%y"):
+        try:
+            return datetime.strptime(value, date_format).date()
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def _birthday_in_year(year, month, day):
+    # 29 February is celebrated on 1 March in common years
+    if (month, day) == (2, 29) and not (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)):
+        return date(year, 3, 1)
+    return date(year, month, day)
+
+
+def _day_of_year(month, day):
+    """Day number of month/day in a leap year, so 29 February has its own slot."""
+    return date(2000, month, day).timetuple().tm_yday
+
+
+def _today_day():
+    today = datetime.now().date()
+    return _day_of_year(today.month, today.day)
+
+
+def _strip_phone_separators(phone):
+    return phone.replace("(", "").replace(")", "").replace("-", "").replace(" ", "")
+
+
+def _phone_value(digits):
+    if len(digits) == 12 and digits.startswith("38"):  # 15.10.23 modify Yulia
+        return "+" + digits
+    elif len(digits) == 10:
+        return '+38' + digits
+    return None
+
+
+def _slot_state(state):
+    # pickles written before __slots__ hold a plain __dict__,
+    # newer ones a (None, slots) pair
+    if isinstance(state, tuple):
+        instance_dict, slots = state
+        state = dict(instance_dict or {})
+        state.update(slots or {})
+    return state
+
 class Field:
+    __slots__ = ('value',)
+
     def __init__(self, value=None):
         self.value = value
 
+    def __reduce__(self):
+        return self.__class__, (self.value,)
+
+    def __setstate__(self, state):
+        for key, value in _slot_state(state).items():
+            setattr(self, key, value)
+
     def set_value(self, value):
         self.value = value
 
@@ -22,13 +134,16 @@ class Field:
         return self.value
 
 class Name(Field):
+    __slots__ = ()
+
     def __init__(self, value):
         super().__init__(value)
 
 
 # 15.10.23 Olga
 class Phone(Field): #15.10.2023 Внесла изменения: проверка формата номера телефона (Оля)
-   
+    __slots__ = ()
+
     def get_value(self): # 15.10.23  Yulia
         return str(self.value)
     
@@ -37,6 +152,7 @@ class Phone(Field): #15.10.2023 Внесла изменения: проверк
     
 
 class Phone(Field):
+    __slots__ = ()
 
     def set_value(self, value):
         validated_phone = self.validate_phone(value) # 15.10.23 modify Yulia
@@ -47,26 +163,15 @@ class Phone(Field):
 
     @staticmethod
     def validate_phone(phone):
-        new_phone = (
-            str(phone).strip()
-            .removeprefix("+")
-            .replace("(", "")
-            .replace(")", "")
-            .replace("-", "")
-            .replace(" ", "")
-        )
-        if new_phone.startswith("38") and len(new_phone) == 12:  # 15.10.23 modify Yulia
-            return "+" + new_phone
-        elif len(new_phone) == 10:
-            return '+38' + new_phone
-        else:
-            return None # 15.10.23 modify Yulia
+        return _phone_value(_strip_phone_separators(str(phone).strip().removeprefix("+")))
         
 
 
 
 # 15.10.23 Yulia 
 class EmailAddress(Field):
+    __slots__ = ()
+
     def __init__(self, value):  # =None убрала 16.10 Olha
         super().__init__(value)
 
@@ -82,8 +187,7 @@ class EmailAddress(Field):
 
     @staticmethod
     def validate_email(email):   #16.10.23
-        pattern = r'[A-Za-z][A-Za-z0-9._]+@[A-Za-z]+\.[A-Za-z]{2,}\b'
-        temp_email = re.findall(pattern, email)
+        temp_email = EMAIL_PATTERN.findall(email)
         if temp_email:
             return "".join(temp_email)  # True
         else:
@@ -91,50 +195,102 @@ class EmailAddress(Field):
 
 
 
+def normalize_phones(phones):
+    """
+    Validate a batch of phone numbers in one pass.
+
+    Returns the normalized numbers (None where invalid) and a validity mask,
+    same rules as Phone.validate_phone.
+    """
+    cleaned = [str(phone).strip().removeprefix("+") for phone in phones]
+    joined = "\0".join(cleaned)
+    if cleaned and joined.count("\0") == len(cleaned) - 1:
+        # strip the separators from the whole batch at once
+        cleaned = _strip_phone_separators(joined).split("\0")
+    else:
+        cleaned = [_strip_phone_separators(phone) for phone in cleaned]
+    values = [_phone_value(digits) for digits in cleaned]
+    return values, [value is not None for value in values]
+
+
+def normalize_emails(emails):
+    """
+    Validate a batch of emails in one pass, like normalize_phones.
+    """
+    findall = EMAIL_PATTERN.findall
+    values = ["".join(findall(str(email))) or None for email in emails]
+    return values, [value is not None for value in values]
+
+
 class Birthday(Field):
+    __slots__ = ('date', 'month_day')
+
+    # days until each month/day, valid for the date in _memo_day only
+    _memo_day = None
+    _memo = {}
+
     def __init__(self, value=None):
-        super().__init__(value)
+        super().__init__()
+        self.date = None
+        self.month_day = None
+        if value is not None:
+            self.set_value(value)
+
+    def __setstate__(self, state):
+        # records pickled before the date was stored only have the string
+        super().__setstate__(state)
+        self.date = _parse_birthday(self.value)
+        self.month_day = self.date.month * 100 + self.date.day if self.date else None
 
     def set_value(self, value):
-        try:
-            datetime.strptime(value, "%d.%m.%y")
-        except ValueError:
-            try:
-                # пытаемся прочитать дату в формате 'dd-mm-yy'
-                datetime.strptime(value, "%d-%m-%y")
-            except ValueError:
-                print("Invalid date format. Please use 'dd.mm.yy'")
-                return
+        birth_date = _parse_birthday(value)
+        if birth_date is None:
+            print("Invalid date format. Please use 'dd.mm.yy'")
+            return
 
         self.value = value
+        self.date = birth_date
+        self.month_day = birth_date.month * 100 + birth_date.day
 
     def days_to_birthday(self):
-        if self.value is None:
+        if self.date is None:
             return None
-        birth_date = datetime.strptime(self.value, "%d.%m.%y").date()
         current_date = datetime.now().date()  # Use only the date part
-
-        # Calculate next birthday date
-        next_birthday_year = current_date.year
-        if (current_date.month, current_date.day) > (birth_date.month, birth_date.day):
-            next_birthday_year += 1
-
-        next_birthday_date = datetime(next_birthday_year, birth_date.month, birth_date.day).date()
-
-        difference = next_birthday_date - current_date
-        days_until_birthday = difference.days
+        if Birthday._memo_day != current_date:
+            Birthday._memo_day = current_date
+            Birthday._memo = {}
+
+        days_until_birthday = Birthday._memo.get(self.month_day)
+        if days_until_birthday is None:
+            # Calculate next birthday date
+            month, day = self.date.month, self.date.day
+            next_birthday_date = _birthday_in_year(current_date.year, month, day)
+            if next_birthday_date < current_date:
+                next_birthday_date = _birthday_in_year(current_date.year + 1, month, day)
+            days_until_birthday = (next_birthday_date - current_date).days
+            Birthday._memo[self.month_day] = days_until_birthday
 
         return days_until_birthday
 
 class Record:
-    
-    
+    __slots__ = ('name', 'phones', 'emails', 'birthday')
+
     def __init__(self, name, birthday=None, email=None):
         self.name = Name(name)
         self.phones = []
         self.emails = [] if email else [EmailAddress(email)]
         self.birthday = Birthday(birthday)
 
+    def __setstate__(self, state):
+        state = _slot_state(state)
+        if 'emails' not in state:
+            # the oldest records kept a single email attribute
+            email = state.pop('email', None)
+            state['emails'] = [email] if email else []
+        state.pop('email', None)
+        for key, value in state.items():
+            setattr(self, key, value)
+
     def add_email(self, email): #16.10.23 Olha
         if isinstance(email, EmailAddress):
             self.emails.append(email)
@@ -204,14 +360,330 @@ class Record:
         else:
             raise ValueError("Email not found")
 
+    def to_fields(self):
+        phones = [p.value for p in self.phones]
+        emails = [e.value for e in self.get_emails()]
+        return self.name.get_value(), phones, emails, self.birthday.value
+
+    @classmethod
+    def from_fields(cls, name, phones, emails, birthday):
+        record = cls(name, birthday)
+        record.phones = [Phone(phone) for phone in phones]
+        record.emails = [EmailAddress(email) for email in emails]
+        return record
+
+
+def _encode_record(record):
+    name, phones, emails, birthday = record.to_fields()
+    return pack_strings([name, birthday]) + pack_strings(phones) + pack_strings(emails)
+
+
+def _decode_record(buffer, offset=0):
+    (name, birthday), offset = unpack_strings(buffer, offset)
+    phones, offset = unpack_strings(buffer, offset)
+    emails, offset = unpack_strings(buffer, offset)
+    return Record.from_fields(name, phones, emails, birthday), offset
+
+
+def _column_value(record, column):
+    if column == COLUMN_NAMES:
+        return record.name.get_value().encode('utf-8')
+    if column == COLUMN_PHONES:
+        return pack_strings([p.value for p in record.phones])
+    if column == COLUMN_EMAILS:
+        return pack_strings([e.value for e in record.get_emails()])
+    birthday = record.birthday
+    raw = birthday.value.encode('utf-8') if birthday.value else b''
+    return BIRTHDAY_KEY.pack(birthday.month_day or 0) + raw
+
+
+class ColumnarFile:
+    """
+    Read-only, memory-mapped view of a columnar address book snapshot.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        magic, version, columns, self.count = COLUMNAR_HEADER.unpack_from(self._map, 0)
+        if magic != COLUMNAR_MAGIC or version != COLUMNAR_VERSION:
+            self.close()
+            raise ValueError(f'{filename} is not a version {COLUMNAR_VERSION} address book')
+        self._columns = [COLUMNAR_COLUMN.unpack_from(self._map, COLUMNAR_HEADER.size + i * COLUMNAR_COLUMN.size)
+                         for i in range(columns)]
+
+    def value(self, column, index):
+        data_position, offsets_position = self._columns[column]
+        start, end = struct.unpack_from('<QQ', self._map, offsets_position + index * 8)
+        return self._map[data_position + start:data_position + end]
+
+    def name(self, index):
+        return self.value(COLUMN_NAMES, index).decode('utf-8')
+
+    def find(self, name):
+        """Row number of name, or None, by bisecting the name order."""
+        order_position = self._columns[COLUMN_NAME_ORDER][0]
+        raw = name.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            row, = NAME_ORDER_ROW.unpack_from(self._map, order_position + middle * NAME_ORDER_ROW.size)
+            if self.value(COLUMN_NAMES, row) < raw:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            row, = NAME_ORDER_ROW.unpack_from(self._map, order_position + low * NAME_ORDER_ROW.size)
+            if self.value(COLUMN_NAMES, row) == raw:
+                return row
+        return None
+
+    def index_fields(self, index):
+        phones, _ = unpack_strings(self.value(COLUMN_PHONES, index))
+        month_day, = BIRTHDAY_KEY.unpack_from(self.value(COLUMN_BIRTHDAYS, index))
+        return phones, month_day or None
+
+    def record(self, index):
+        phones, _ = unpack_strings(self.value(COLUMN_PHONES, index))
+        emails, _ = unpack_strings(self.value(COLUMN_EMAILS, index))
+        birthday = self.value(COLUMN_BIRTHDAYS, index)[BIRTHDAY_KEY.size:].decode('utf-8') or None
+        return Record.from_fields(self.name(index), phones, emails, birthday)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def write_columnar(filename, snapshot, source=None):
+    """
+    Write snapshot, a list of (name, record or row index in source), as a
+    columnar file. Rows still in source are copied without being decoded.
+    """
+    with open(filename, 'wb') as file:
+        file.write(COLUMNAR_HEADER.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, 5, len(snapshot)))
+        file.write(bytes(COLUMNAR_COLUMN.size * 5))
+        table = []
+        names = []
+        for column in range(4):
+            data_position = file.tell()
+            offsets = array('Q', [0])
+            end = 0
+            for _, value in snapshot:
+                raw = source.value(column, value) if isinstance(value, int) else _column_value(value, column)
+                file.write(raw)
+                end += len(raw)
+                offsets.append(end)
+                if column == COLUMN_NAMES:
+                    names.append(raw)
+            if sys.byteorder == 'big':
+                offsets.byteswap()
+            offsets_position = file.tell()
+            file.write(offsets.tobytes())
+            table.append(COLUMNAR_COLUMN.pack(data_position, offsets_position))
+
+        # the name order is fixed width, it has no offsets
+        order = array('I', sorted(range(len(names)), key=names.__getitem__))
+        del names
+        if sys.byteorder == 'big':
+            order.byteswap()
+        table.append(COLUMNAR_COLUMN.pack(file.tell(), 0))
+        file.write(order.tobytes())
+        file.seek(COLUMNAR_HEADER.size)
+        file.write(b''.join(table))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+class LazyRecords(MutableMapping):
+    """
+    Contacts by name, backed by a columnar file.
+
+    Records are built from the file the first time they are looked up,
+    until then only their row number is kept. Until the contacts are
+    listed, names are bisected in the file and changes are kept in an
+    overlay, so replaying a journal does not read every name.
+    """
+    def __init__(self, source=None):
+        self.source = source
+        self._slots = None if source is not None else {}
+        self._changes = {}  # overlay: name -> record, None once deleted
+        self._readded = set()  # deleted and added again, they move to the end
+        self._count = source.count if source is not None else 0
+
+    @classmethod
+    def from_dict(cls, records):
+        lazy = cls()
+        lazy._slots.update(records)
+        return lazy
+
+    def _keys(self):
+        if self._slots is None:
+            slots = {self.source.name(i): i for i in range(self.source.count)}
+            for name, record in self._changes.items():
+                if record is None or name in self._readded:
+                    slots.pop(name, None)
+                if record is not None:
+                    slots[name] = record
+            self._slots = slots
+            self._changes = {}
+            self._readded = set()
+        return self._slots
+
+    def _value(self, name):
+        """Record or row number of name, None when there is no such contact."""
+        if self._slots is not None:
+            return self._slots.get(name)
+        if name in self._changes:
+            return self._changes[name]
+        return self.source.find(name)
+
+    def __getitem__(self, name):
+        value = self._value(name)
+        if value is None:
+            raise KeyError(name)
+        if isinstance(value, int):
+            value = self.source.record(value)
+            if self._slots is not None:
+                self._slots[name] = value
+            else:
+                self._changes[name] = value
+        return value
+
+    def __setitem__(self, name, record):
+        if self._value(name) is None:
+            self._count += 1
+        if self._slots is not None:
+            self._slots[name] = record
+            return
+        if name in self._changes and self._changes[name] is None:
+            del self._changes[name]
+            self._readded.add(name)
+        self._changes[name] = record
+
+    def __delitem__(self, name):
+        if self._value(name) is None:
+            raise KeyError(name)
+        self._count -= 1
+        if self._slots is not None:
+            del self._slots[name]
+        else:
+            self._changes[name] = None
+
+    def __contains__(self, name):
+        return self._value(name) is not None
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return self._count if self._slots is None else len(self._slots)
+
+    def peek(self, name):
+        """Like self[name], but a record built from the file is not kept."""
+        value = self._value(name)
+        if value is None:
+            raise KeyError(name)
+        return self.source.record(value) if isinstance(value, int) else value
+
+    def index_fields(self, name):
+        """Phones and birthday key of a contact without building its Record."""
+        value = self._value(name)
+        if value is None:
+            return None
+        if isinstance(value, int):
+            return self.source.index_fields(value)
+        return [p.value for p in value.phones], value.birthday.month_day
+
+    def snapshot(self):
+        return list(self._keys().items())
+
+    def rebase(self, source, snapshot):
+        """Point rows that were written out in snapshot at the new source."""
+        old_source = self.source
+        self.source = source
+        for index, (name, value) in enumerate(snapshot):
+            if isinstance(value, int) and self._slots.get(name) == value:
+                self._slots[name] = index
+        return old_source
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    # address books pickled before the columnar format, contact classes only
+    allowed = {'Field', 'Name', 'Phone', 'EmailAddress', 'Birthday', 'Record'}
+
+    def find_class(self, module, name):
+        if module in ('__main__', __name__) and name in self.allowed:
+            return globals()[name]
+        raise pickle.UnpicklingError(f'{module}.{name} is not allowed in an address book')
+
+
+def _blocking_keys(record):
+    keys = set()
+    # spelled in Latin letters, so 'Олег' and 'Oleh' share a block
+    name = ''.join(filter(str.isalnum, transliterate(record.name.get_value()).lower()))
+    if name:
+        keys.add('name:' + name)
+    for phone in record.phones:
+        if phone.value:
+            keys.add('phone:' + phone.value)
+    for email in record.get_emails():
+        if email.value:
+            keys.add('email:' + email.value.split('@', 1)[0].lower())
+    return keys
+
+
+def _add_postings(postings, grams, name):
+    for gram in grams:
+        postings.setdefault(gram, set()).add(name)
+
+
+def _remove_postings(postings, grams, name):
+    for gram in grams:
+        names = postings.get(gram)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del postings[gram]
+
+
 class AddressBook(UserDict):
     def __init__(self, filename):
         super().__init__()
+        self.data = LazyRecords()
         self.page_size = 5
         self.filename = filename
+        self._journal = Journal(filename, filename + '.journal', JOURNAL_MAGIC)
+        self._dirty = {}
+        # search index, built on the first search
+        self._name_grams = None
+        self._phone_grams = None
+        self._terms = {}
+        self._positions = {}
+        self._next_position = 0
+        # birthday calendar, sorted by day of year, built on the first query
+        self._birthday_days = None
+        self._birthday_names = None
+        self._birthday_keys = {}
+        self._no_birthday_names = None
+        # paging orders, built on the first page request
+        self._added_seqs = None
+        self._added_names = None
+        self._added_keys = {}
+        self._next_seq = 0
+        self._sorted_names = None
 
     def add_record(self, record):
-        self.data[record.name.get_value()] = record
+        name = record.name.get_value()
+        self.data[name] = record
+        self.touch(name)
 
     def find(self, name):
         return self.data.get(name)
@@ -219,42 +691,398 @@ class AddressBook(UserDict):
     def delete(self, name):
         if name in self.data:
             del self.data[name]
+            self.touch(name)
 
-    def iterator(self):
-        records = list(self.data.values())
-        for i in range(0, len(records), self.page_size):
-            yield records[i:i + self.page_size]
+    def touch(self, name):
+        """
+        Mark a contact as changed, so the next save writes it to the journal.
+        """
+        self._dirty[name] = None
+        if self._name_grams is not None:
+            self._reindex(name)
+        if self._birthday_days is not None:
+            self._reindex_birthday(name)
+        if self._added_seqs is not None:
+            self._reindex_order(name)
+
+    def edit_phone(self, name, phone, new_phone):
+        self.data[name].edit_phone(phone, new_phone)
+        self.touch(name)
+
+    def remove_phone(self, name, phone):
+        self.data[name].remove_phone(phone)
+        self.touch(name)
 
     def save_to_file(self):
+        """
+        Append the contacts changed since the last save to the journal.
+
+        Only the changed records are written, the full snapshot is rebuilt
+        by compact() once the journal grows as big as the book itself.
+        """
+        self._journal.wait(block=False)
         try:
-            with open(self.filename, 'wb') as file:
-                pickle.dump(self.data, file)
+            with self._journal.lock:
+                if self._dirty:
+                    self._journal.append(self._dirty_records())
+                    self._dirty.clear()
             print(f'Address book saved to {self.filename}')
         except Exception as e:
             print(f'Error saving to {self.filename}: {str(e)}')
+            return
+
+        if self._journal.should_compact(len(self.data)):
+            self.compact(background=True)
+
+    def _dirty_records(self):
+        for name in self._dirty:
+            record = self.data.get(name)
+            if record is None:
+                yield JOURNAL_DELETE, pack_strings([name])
+            else:
+                yield JOURNAL_PUT, _encode_record(record)
+
+    def compact(self, background=False):
+        """
+        Write a fresh snapshot of the whole book and drop the journal.
+
+        The current journal is frozen first, so new changes keep going to a
+        new journal while the snapshot is being written.
+        """
+        self._journal.compact(self._take_snapshot, self._write_snapshot, self._finish_compaction, background)
+
+    def _take_snapshot(self):
+        self._dirty.clear()
+        return self.data.snapshot()
+
+    def _write_snapshot(self, snapshot):
+        write_columnar(self.filename + '.tmp', snapshot, self.data.source)
+        return snapshot
+
+    def _finish_compaction(self, snapshot):
+        # swapping files happens on the main thread, while nothing reads the old map
+        had_source = self.data.source is not None
+        try:
+            # Windows will not replace a file that is still mapped
+            self.data.close()
+            os.replace(self.filename + '.tmp', self.filename)
+        except Exception as e:
+            print(f"Error compacting {self.filename}: {e}")
+            if had_source:
+                # the old snapshot is still in place, and its rows are where they were
+                self.data.source = ColumnarFile(self.filename)
+            return False
+        self.data.rebase(ColumnarFile(self.filename), snapshot)
+        return True
+
+    def close(self):
+        self._journal.wait()
+        with self._journal.lock:
+            self._journal.close()
+        self.data.close()
 
     def read_from_file(self):
+        """
+        Open the snapshot and replay the journal on top of it.
+
+        Columnar snapshots are only mapped, records are read when used.
+        A book pickled by an older version is converted once.
+        """
+        self._journal.wait()
+        convert = False
         try:
             with open(self.filename, 'rb') as file:
-                data = pickle.load(file)
-                self.data = data
+                magic = file.read(len(COLUMNAR_MAGIC))
+                if magic != COLUMNAR_MAGIC:
+                    file.seek(0)
+                    records = _LegacyUnpickler(file).load()
+            self.data.close()
+            if magic == COLUMNAR_MAGIC:
+                self.data = LazyRecords(ColumnarFile(self.filename))
+            else:
+                self.data = LazyRecords.from_dict(records)
+                convert = True
             print(f'Address book loaded from {self.filename}')
         except FileNotFoundError:
             print(f'File {self.filename} not found. Creating a new address book.')
         except Exception as e:
             print(f'Error reading from {self.filename}: {str(e)}')
 
+        self._drop_indexes()
+        self._journal.replay(self._apply_journal_record)
+        if convert:
+            self.compact()
+        if convert:
+            print(f'Address book {self.filename} converted to the columnar format.')
+
+    def _drop_indexes(self):
+        # rebuilt on next use, cheaper than updating them one record at a time
+        self._name_grams = None
+        self._birthday_days = None
+        self._added_seqs = None
+
+    def _apply_journal_record(self, operation, payload):
+        if operation == JOURNAL_PUT:
+            record, end = _decode_record(payload)
+            name = record.name.get_value()
+        elif operation == JOURNAL_DELETE:
+            (name,), end = unpack_strings(payload)
+            record = None
+        else:
+            raise ValueError(f'unknown journal operation {operation}')
+        if end != len(payload):
+            raise ValueError('journal record longer than what it holds')
+        if record is None:
+            self.data.pop(name, None)
+        else:
+            self.data[name] = record
+
     def search(self, query):
+        """
+        Find contacts whose name or phone contains query, in book order.
+        """
         query = query.lower()
-        results = []
-        for record in self.data.values():
-            if query in record.name.get_value().lower():
-                results.append(record)
+        if not query:
+            return list(self.data.values())
+        self._build_search_index()
+
+        names = self._lookup(self._name_grams, query)
+        phones = self._lookup(self._phone_grams, query)
+        if len(query) > NGRAM_SIZE:
+            # the n-grams only narrow the candidates down, check the full query
+            names = {name for name in names if query in self._terms[name][0]}
+            phones = {name for name in phones if any(query in phone for phone in self._terms[name][1])}
+        matches = sorted(names | phones, key=self._positions.__getitem__)
+        return [self.data[name] for name in matches]
+
+    @staticmethod
+    def _lookup(postings, query):
+        if len(query) <= NGRAM_SIZE:
+            return set(postings.get(query, ()))
+        grams = {query[i:i + NGRAM_SIZE] for i in range(len(query) - NGRAM_SIZE + 1)}
+        candidates = sorted((postings.get(gram, set()) for gram in grams), key=len)
+        result = set(candidates[0])
+        for names in candidates[1:]:
+            if not result:
+                break
+            result &= names
+        return result
+
+    def _build_search_index(self):
+        if self._name_grams is not None:
+            return
+        self._name_grams = {}
+        self._phone_grams = {}
+        self._terms = {}
+        self._positions = {}
+        self._next_position = 0
+        for name in self.data:
+            self._reindex(name)
+
+    def _reindex(self, name):
+        old_terms = self._terms.pop(name, None)
+        if old_terms is not None:
+            _remove_postings(self._name_grams, _ngrams(old_terms[0]), name)
+            for phone in old_terms[1]:
+                _remove_postings(self._phone_grams, _ngrams(phone), name)
+
+        fields = self.data.index_fields(name)
+        if fields is None:
+            self._positions.pop(name, None)
+            return
+        if name not in self._positions:
+            self._positions[name] = self._next_position
+            self._next_position += 1
+        terms = (name.lower(), tuple(str(phone) for phone in fields[0] if phone))
+        self._terms[name] = terms
+        _add_postings(self._name_grams, _ngrams(terms[0]), name)
+        for phone in terms[1]:
+            _add_postings(self._phone_grams, _ngrams(phone), name)
+
+    def upcoming_birthdays(self, days):
+        """
+        Contacts whose birthday comes in the next days days, nearest first.
+        """
+        self._build_birthday_index()
+        if days >= 365:
+            names = self._birthday_names
+        else:
+            today = datetime.now().date()
+            # one day of slack on both sides covers 29 February in common years,
+            # the exact distance is checked below for the few candidates found
+            start = _day_of_year(today.month, today.day) - 1
+            end = start + days + 2
+            names = self._birthday_range(start, min(end, 366))
+            if end > 366:
+                names += self._birthday_range(1, end - 366)
+
+        upcoming = []
+        for name in dict.fromkeys(names):
+            days_left = self.data[name].birthday.days_to_birthday()
+            if days_left is not None and days_left <= days:
+                upcoming.append((days_left, name))
+        upcoming.sort()
+        return [self.data[name] for _, name in upcoming]
+
+    def _birthday_range(self, first_day, last_day):
+        start = bisect_left(self._birthday_days, first_day)
+        end = bisect_right(self._birthday_days, last_day)
+        return self._birthday_names[start:end]
+
+    def _birthday_position(self, day, name):
+        # the calendar is sorted by (day, name), this is the index after them
+        low = bisect_left(self._birthday_days, day)
+        high = bisect_right(self._birthday_days, day, low)
+        return bisect_right(self._birthday_names, name, low, high)
+
+    def _build_birthday_index(self):
+        if self._birthday_days is not None:
+            return
+        self._birthday_keys = {}
+        entries = []
+        no_birthday = []
+        for name in self.data:
+            month_day = self.data.index_fields(name)[1]
+            if month_day is not None:
+                day = _day_of_year(month_day // 100, month_day % 100)
+                self._birthday_keys[name] = day
+                entries.append((day, name))
+            else:
+                no_birthday.append(name)
+        entries.sort()
+        self._birthday_days = [day for day, _ in entries]
+        self._birthday_names = [name for _, name in entries]
+        self._no_birthday_names = sorted(no_birthday)
+
+    def _reindex_birthday(self, name):
+        old_day = self._birthday_keys.pop(name, None)
+        if old_day is not None:
+            start = bisect_left(self._birthday_days, old_day)
+            end = bisect_right(self._birthday_days, old_day)
+            i = self._birthday_names.index(name, start, end)
+            del self._birthday_days[i]
+            del self._birthday_names[i]
+        else:
+            i = bisect_left(self._no_birthday_names, name)
+            if i < len(self._no_birthday_names) and self._no_birthday_names[i] == name:
+                del self._no_birthday_names[i]
+
+        fields = self.data.index_fields(name)
+        if fields is None:
+            return
+        month_day = fields[1]
+        if month_day is not None:
+            day = _day_of_year(month_day // 100, month_day % 100)
+            i = self._birthday_position(day, name)
+            self._birthday_days.insert(i, day)
+            self._birthday_names.insert(i, name)
+            self._birthday_keys[name] = day
+        else:
+            self._no_birthday_names.insert(bisect_left(self._no_birthday_names, name), name)
+
+    def find_duplicates(self, max_block=DEDUP_MAX_BLOCK):
+        """
+        Groups of contacts that look like the same person.
+
+        Contacts are put in blocks by phone, email local part and
+        transliterated name. Contacts sharing a block are joined into one
+        group with union-find, so the whole search stays near-linear.
+        Returns lists of names in book order, largest groups first.
+        """
+        blocks = {}
+        for name in self.data:
+            for key in _blocking_keys(self.data.peek(name)):
+                blocks.setdefault(key, []).append(name)
+
+        parent = {}
+
+        def root(name):
+            parent.setdefault(name, name)
+            while parent[name] != name:
+                parent[name] = parent[parent[name]]
+                name = parent[name]
+            return name
+
+        for names in blocks.values():
+            if 1 < len(names) <= max_block:
+                first = root(names[0])
+                for other in names[1:]:
+                    other = root(other)
+                    if other != first:
+                        parent[other] = first
+
+        groups = {}
+        for name in self.data:
+            if name in parent:
+                groups.setdefault(root(name), []).append(name)
+        duplicates = [names for names in groups.values() if len(names) > 1]
+        duplicates.sort(key=len, reverse=True)
+        return duplicates
+
+    def merge_contacts(self, names):
+        """
+        Merge the contacts into the first one and delete the others.
+
+        Phones and emails are combined without repeats, the first birthday
+        found is kept.
+        """
+        records = [self.data[name] for name in names]
+        target = records[0]
+        phones = {p.value for p in target.phones}
+        emails = {e.value for e in target.get_emails()}
+        for name, record in zip(names[1:], records[1:]):
+            if record is target:
+                continue
             for phone in record.phones:
-                if query in phone.get_value():
-                    results.append(record)
-        return results
-    
+                if phone.value and phone.value not in phones:
+                    target.phones.append(Phone(phone.value))
+                    phones.add(phone.value)
+            for email in record.get_emails():
+                if email.value and email.value not in emails:
+                    target.emails.append(EmailAddress(email.value))
+                    emails.add(email.value)
+            if target.birthday.date is None and record.birthday.date is not None:
+                target.birthday.set_value(record.birthday.value)
+            self.delete(name)
+        self.touch(names[0])
+        return target
+
+    def import_contacts(self, filename, file_format=None):
+        """
+        Add contacts from a CSV, JSON Lines or vCard file.
+
+        The file is read and validated in chunks and saved once at the end.
+        Returns the number of contacts imported and a list of
+        (line number, error) for the rows that were skipped.
+        """
+        file_format = _contact_format(filename, file_format)
+        imported = 0
+        errors = []
+        # utf-8-sig skips the byte order mark Excel puts in front of CSV files
+        with open(filename, 'r', encoding='utf-8-sig', newline='') as file:
+            rows = CONTACT_READERS[file_format](file)
+            while True:
+                chunk = [row for _, row in zip(range(IMPORT_CHUNK_SIZE), rows)]
+                if not chunk:
+                    break
+                records, chunk_errors = _validate_contacts(chunk)
+                for record in records:
+                    self.data[record.name.get_value()] = record
+                imported += len(records)
+                errors.extend(chunk_errors)
+
+        if imported:
+            self._drop_indexes()
+            self.compact()
+        return imported, errors
+
+    def export_contacts(self, filename, file_format=None):
+        """
+        Write every contact to a CSV, JSON Lines or vCard file.
+        """
+        file_format = _contact_format(filename, file_format)
+        with open(filename, 'w', encoding='utf-8', newline='') as file:
+            return CONTACT_WRITERS[file_format](file, self.stream())
 
     #15.10.23 Yulia
     def delete_contact(self, name):
@@ -262,7 +1090,7 @@ class AddressBook(UserDict):
         Delete a contact by name.
         """
         if name in self.data:
-            del self.data[name]
+            self.delete(name)
             self.save_to_file()  # Save data after each deletion
             print(f"Contact {name} deleted from address_bot - saved.")
         else:
@@ -270,27 +1098,293 @@ class AddressBook(UserDict):
 
 #Yuliya 18.10.23
     def iterator(self, page_number=None):
-            records = list(self.data.values())
+        if page_number:
+            return self.get_page(page_number)
+        return list(self.stream())
 
-            if page_number:
-                start_idx = (page_number - 1) * self.page_size
-                end_idx = start_idx + self.page_size
-                page_records = records[start_idx:end_idx]
-            else:
-                page_records = records
+    def get_page(self, page_number, sort='added'):
+        start = (page_number - 1) * self.page_size
+        return [self.data[name] for name in self._page_names(sort, start, self.page_size)]
 
-            return page_records
-    
-    def get_page(self, page_number):
-        start_index = (page_number - 1) * self.page_size
-        end_index = start_index + self.page_size
-        records = list(self.data.values())[start_index:end_index]
-        return records
-
-    def get_total_pages(self):
-        total_contacts = len(self.data)
+    def page_after(self, cursor=None, sort='added'):
+        """
+        One page of records following cursor and the cursor of the next page.
+
+        A cursor is 'sort:key' where key is the last contact of the page, as
+        its place in the order ('day:name' for the birthday order, day 0
+        for no birthday), so paging by cursor is not thrown off by contacts
+        added or deleted in between. The next cursor is None after the last
+        page.
+        """
+        key = None
+        if cursor:
+            sort, _, key = cursor.partition(':')
+        self._build_page_index(sort)
+        if sort == 'added':
+            start = bisect_right(self._added_seqs, int(key)) if key else 0
+        elif sort == 'name':
+            start = bisect_right(self._sorted_names, key) if key else 0
+        else:
+            start = self._birthday_start(key) if key else 0
+
+        names = self._page_names(sort, start, self.page_size)
+        end = start + len(names)
+        if not names or end >= self._page_total(sort):
+            next_cursor = None
+        elif sort == 'added':
+            next_cursor = f'added:{self._added_keys[names[-1]]}'
+        elif sort == 'name':
+            next_cursor = f'name:{names[-1]}'
+        else:
+            next_cursor = f'birthday:{self._birthday_keys.get(names[-1], 0)}:{names[-1]}'
+        return [self.data[name] for name in names], next_cursor
+
+    def stream(self, sort='added'):
+        """
+        Yield every record in the given order without keeping them in memory.
+        """
+        self._build_page_index(sort)
+        for start in range(0, self._page_total(sort), self.page_size):
+            for name in self._page_names(sort, start, self.page_size):
+                yield self.data.peek(name)
+
+    def get_total_pages(self, sort='added'):
+        total_contacts = len(self.data) if sort == 'added' else self._page_total(sort)
         return (total_contacts + self.page_size - 1) // self.page_size
 
+    def _page_total(self, sort):
+        self._build_page_index(sort)
+        if sort == 'birthday':
+            return len(self._birthday_names) + len(self._no_birthday_names)
+        return len(self._added_names if sort == 'added' else self._sorted_names)
+
+    def _page_names(self, sort, start, count):
+        self._build_page_index(sort)
+        if sort == 'added':
+            return self._added_names[start:start + count]
+        if sort == 'name':
+            return self._sorted_names[start:start + count]
+
+        # the birthday calendar read from today's date on, wrapping at New
+        # Year, then the contacts without a birthday by name
+        names = self._birthday_names
+        first = bisect_left(self._birthday_days, _today_day())
+        calendar = [names[(first + i) % len(names)] for i in range(start, min(start + count, len(names)))]
+        return calendar + self._no_birthday_names[max(start - len(names), 0):max(start + count - len(names), 0)]
+
+    def _birthday_start(self, key):
+        # where the birthday order goes on after the contact in key
+        day, _, name = key.partition(':')
+        day = int(day)
+        if not day:
+            return len(self._birthday_names) + bisect_right(self._no_birthday_names, name)
+        today = _today_day()
+        first = bisect_left(self._birthday_days, today)
+        position = self._birthday_position(day, name)
+        if day >= today:
+            return position - first
+        return len(self._birthday_names) - first + position
+
+    def _build_page_index(self, sort):
+        if sort not in PAGE_SORTS:
+            raise ValueError(f"Unknown sort order '{sort}'")
+        if sort == 'birthday':
+            self._build_birthday_index()
+        elif self._added_seqs is None:
+            self._added_names = list(self.data)
+            self._added_seqs = list(range(len(self._added_names)))
+            self._added_keys = dict(zip(self._added_names, self._added_seqs))
+            self._next_seq = len(self._added_names)
+            self._sorted_names = sorted(self._added_names)
+
+    def _reindex_order(self, name):
+        present = name in self.data
+        seq = self._added_keys.get(name)
+        if present and seq is None:
+            self._added_keys[name] = self._next_seq
+            self._added_seqs.append(self._next_seq)
+            self._added_names.append(name)
+            self._next_seq += 1
+            self._sorted_names.insert(bisect_left(self._sorted_names, name), name)
+        elif not present and seq is not None:
+            del self._added_keys[name]
+            i = bisect_left(self._added_seqs, seq)
+            del self._added_seqs[i]
+            del self._added_names[i]
+            del self._sorted_names[bisect_left(self._sorted_names, name)]
+
+
+def _contact_format(filename, file_format=None):
+    file_format = file_format or CONTACT_FORMATS.get(os.path.splitext(filename)[1].lower())
+    if file_format not in CONTACT_READERS:
+        raise ValueError(f"Unknown contacts file format for {filename}, use .csv, .jsonl or .vcf")
+    return file_format
+
+
+def _split_list(value):
+    return [item.strip() for item in (value or '').split(LIST_SEPARATOR) if item.strip()]
+
+
+def _read_csv_contacts(file):
+    reader = csv.reader(file)
+    header = [column.strip().lower() for column in next(reader, [])]
+    columns = [header.index(field) if field in header else None for field in CSV_FIELDS]
+    for row in reader:
+        if not row:
+            continue
+        name, phones, emails, birthday = (row[i] if i is not None and i < len(row) else None for i in columns)
+        yield reader.line_num, {
+            'name': name,
+            'phones': _split_list(phones),
+            'emails': _split_list(emails),
+            'birthday': birthday,
+        }
+
+
+def _read_jsonl_contacts(file):
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def _vcard_birthday(value):
+    for date_format in ("%Y-%m-%d", "%Y%m%d"):
+        try:
+            return datetime.strptime(value, date_format).strftime("%d.%m.%y")
+        except ValueError:
+            pass
+    return value
+
+
+def _read_vcard_contacts(file):
+    card = None
+    start = 0
+    last_property = None
+    for line_number, line in enumerate(file, 1):
+        line = line.rstrip('\r\n')
+        if card is not None and line[:1] in (' ', '\t'):
+            # folded line, continues the previous property
+            if last_property:
+                card[last_property][-1] += line[1:]
+            continue
+        key, _, value = line.partition(':')
+        key = key.split(';', 1)[0].upper()
+        last_property = None
+        if key == 'BEGIN' and value.strip().upper() == 'VCARD':
+            card = {'FN': [], 'TEL': [], 'EMAIL': [], 'BDAY': []}
+            start = line_number
+        elif key == 'END' and card is not None:
+            yield start, {
+                'name': card['FN'][0] if card['FN'] else None,
+                'phones': card['TEL'],
+                'emails': card['EMAIL'],
+                'birthday': _vcard_birthday(card['BDAY'][0]) if card['BDAY'] else None,
+            }
+            card = None
+        elif card is not None and key in card:
+            card[key].append(value.strip())
+            last_property = key
+
+
+def _list_field(row, field):
+    """
+    Phones or emails of a row as a list of strings, a string is split like
+    a CSV cell. None when the value is neither.
+    """
+    value = row.get(field)
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return _split_list(value)
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return value
+    return None
+
+
+def _validate_contacts(rows):
+    rows = [(line_number, row, row and _list_field(row, 'phones'), row and _list_field(row, 'emails'))
+            for line_number, row in rows]
+    # all phones and emails of the chunk are normalized in one batch each
+    phones, _ = normalize_phones([phone for _, _, raw_phones, _ in rows for phone in raw_phones or []])
+    emails, _ = normalize_emails([email for _, _, _, raw_emails in rows for email in raw_emails or []])
+
+    records = []
+    errors = []
+    phone_at = email_at = 0
+    for line_number, row, raw_phones, raw_emails in rows:
+        if row is None:
+            errors.append((line_number, "unreadable row"))
+            continue
+        row_phones = phones[phone_at:phone_at + len(raw_phones or ())]
+        row_emails = emails[email_at:email_at + len(raw_emails or ())]
+        phone_at += len(row_phones)
+        email_at += len(row_emails)
+
+        name = str(row.get('name') or '').strip().lower()
+        birthday = row.get('birthday') or None
+        if raw_phones is None:
+            errors.append((line_number, "phones must be a list of strings"))
+        elif raw_emails is None:
+            errors.append((line_number, "emails must be a list of strings"))
+        elif not name:
+            errors.append((line_number, "missing name"))
+        elif None in row_phones:
+            errors.append((line_number, f"invalid phone number {raw_phones[row_phones.index(None)]}"))
+        elif None in row_emails:
+            errors.append((line_number, f"invalid email {raw_emails[row_emails.index(None)]}"))
+        elif birthday is not None and _parse_birthday(str(birthday)) is None:
+            errors.append((line_number, f"invalid birthday {birthday}"))
+        else:
+            records.append(Record.from_fields(name, row_phones, row_emails, birthday))
+    return records, errors
+
+
+def _write_csv_contacts(file, records):
+    writer = csv.writer(file)
+    writer.writerow(CSV_FIELDS)
+    count = 0
+    for record in records:
+        name, phones, emails, birthday = record.to_fields()
+        writer.writerow((name, LIST_SEPARATOR.join(p for p in phones if p),
+                         LIST_SEPARATOR.join(e for e in emails if e), birthday or ''))
+        count += 1
+    return count
+
+
+def _write_jsonl_contacts(file, records):
+    count = 0
+    for record in records:
+        name, phones, emails, birthday = record.to_fields()
+        file.write(json.dumps({'name': name, 'phones': [p for p in phones if p],
+                               'emails': [e for e in emails if e], 'birthday': birthday},
+                              ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+def _write_vcard_contacts(file, records):
+    count = 0
+    for record in records:
+        name, phones, emails, _ = record.to_fields()
+        lines = ['BEGIN:VCARD', 'VERSION:3.0', f'FN:{name}', f'N:{name};;;;']
+        lines += [f'TEL;TYPE=CELL:{phone}' for phone in phones if phone]
+        lines += [f'EMAIL:{email}' for email in emails if email]
+        if record.birthday.date:
+            lines.append(f'BDAY:{record.birthday.date.isoformat()}')
+        lines.append('END:VCARD')
+        file.write('\r\n'.join(lines) + '\r\n')
+        count += 1
+    return count
+
+
+CONTACT_READERS = {'csv': _read_csv_contacts, 'jsonl': _read_jsonl_contacts, 'vcard': _read_vcard_contacts}
+CONTACT_WRITERS = {'csv': _write_csv_contacts, 'jsonl': _write_jsonl_contacts, 'vcard': _write_vcard_contacts}
+
 
 def handle_command(address_book, command):
    # Розділити введену команду на частини
@@ -324,13 +1418,11 @@ def handle_command(address_book, command):
 
         record = Record(name, birthday, email)
 
-        for phone in phones:
-            phone_value = Phone.validate_phone(phone)
-            if phone_value:
-                phone_obj = Phone(phone_value)
-                record.add_phone(phone_obj)
-            else:
-                return "Invalid phone number format"
+        phone_values, valid = normalize_phones(phones)
+        if not all(valid):
+            return "Invalid phone number format"
+        for phone_value in phone_values:
+            record.add_phone(Phone(phone_value))
         
 
         # Add email if present
@@ -412,7 +1504,7 @@ def handle_command(address_book, command):
             if change_type == "phone" and len(args) >= 3:
                 new_phone = args[2]
                 try:
-                    record.edit_phone(record.phones[0].get_value(), new_phone)
+                    address_book.edit_phone(name, record.phones[0].get_value(), new_phone)
                     address_book.save_to_file()
                     # Empty string to suppress success message
                     return "" if Phone.validate_phone(new_phone) else ""
@@ -423,6 +1515,7 @@ def handle_command(address_book, command):
                 new_email = args[2]
                 try:
                     record.edit_email(record.emails[0].get_value(), new_email)
+                    address_book.touch(name)
                     # Save only if email change is successful
                     address_book.save_to_file()
                     return ""  # Empty string to suppress success message
@@ -433,14 +1526,12 @@ def handle_command(address_book, command):
 #modify Yuliya 18.10.23
             elif change_type == "birthday" and len(args) >= 3:
                 new_birthday = args[2]
-                try:
-                    datetime.strptime(new_birthday, "%d.%m.%y")
-                    record.birthday.set_value(new_birthday)
-                    address_book.save_to_file()
-                    return f"Contact {name} birthday changed to {new_birthday}"
-                except ValueError:
-                    print("Invalid date format. Please use 'dd.mm.yy'")
+                if _parse_birthday(new_birthday) is None:
                     return f"Contact {name} birthday didn't change. Invalid date format. Please use 'dd.mm.yy'"
+                record.birthday.set_value(new_birthday)
+                address_book.touch(name)
+                address_book.save_to_file()
+                return f"Contact {name} birthday changed to {new_birthday}"
 
 
 # 15.10.23 Nazar
@@ -512,12 +1603,13 @@ def handle_command(address_book, command):
 # 14.10.23 Nazar / Yuliya pagination 18.10.23
     elif action == "show" and args and args[0] == "all":
         page_number = int(args[1]) if len(args) > 1 and args[1].isdigit() else 1
-        total_pages = address_book.get_total_pages()
+        sort = args[-1] if len(args) > 1 and args[-1] in PAGE_SORTS else 'added'
+        total_pages = address_book.get_total_pages(sort)
 
         if page_number < 1 or page_number > total_pages:
             return f"Invalid page number. Please provide a number between 1 and {total_pages}."
 
-        page_records = address_book.iterator(page_number)
+        page_records = address_book.get_page(page_number, sort)
 
         if not page_records:
             return f"No contacts found on page {page_number}."
@@ -541,10 +1633,11 @@ def handle_command(address_book, command):
         prev_page = page_number - 1 if page_number > 1 else None
         next_page = page_number + 1 if page_number < total_pages else None
         pagination_info = f"\nPage {page_number} of {total_pages} |"
+        sort_suffix = f" {sort}" if sort != 'added' else ""
         if prev_page is not None:
-            pagination_info += f" Previous: 'show all {prev_page}' |"
+            pagination_info += f" Previous: 'show all {prev_page}{sort_suffix}' |"
         if next_page is not None:
-            pagination_info += f" Next: 'show all {next_page}' |"
+            pagination_info += f" Next: 'show all {next_page}{sort_suffix}' |"
         contacts_info.append(pagination_info)
 
         return "\n".join(contacts_info)
@@ -556,12 +1649,9 @@ def handle_command(address_book, command):
 
         days_until_celebration = int(args[1])
         upcoming_birthdays = []
-        for record in address_book.data.values():
-            if record.birthday.get_value():
-                days_left = record.birthday.days_to_birthday()
-                if days_left is not None and days_left <= days_until_celebration:
-                    phones_str = ', '.join([p.get_value() for p in record.phones])
-                    upcoming_birthdays.append(f"{record.name.get_value()}: {phones_str} | {record.birthday.get_value()}. Don't forget to greet!")
+        for record in address_book.upcoming_birthdays(days_until_celebration):
+            phones_str = ', '.join([p.get_value() for p in record.phones])
+            upcoming_birthdays.append(f"{record.name.get_value()}: {phones_str} | {record.birthday.get_value()}. Don't forget to greet!")
 
         if upcoming_birthdays:
             return f"Upcoming birthdays in the next {days_until_celebration} days:\n" + "\n".join(upcoming_birthdays)
@@ -576,7 +1666,7 @@ def handle_command(address_book, command):
         return (
             "Available commands:\n"
             "  - add [name] [phone][birthday] [emai]: Add a new contact with optional phones and birthday.\n"
-            "  - show all: Display all contacts with phones and optional days until the next birthday.\n"
+            "  - show all [page] [name|birthday]: Display all contacts with phones and optional days until the next birthday.\n"
             "  - celebration in [days]: Show upcoming birthdays in the next [days] days with names and phones.\n"
             "  - helper: Display available commands and their descriptions.\n"
             "  - find [letter] or [number]: Display all contacts with letter or number, which you saied about.\n"
@@ -586,7 +1676,10 @@ def handle_command(address_book, command):
             "  - goodbye, close, exit: Save the address book to a file and exit the program.\n"
             "  - clean: Open sorter.\n"  #15.10.23 Alex
             "  - notebook: Open notes.\n" #15.10.23 Alex 
-            "  - email [name]: Shows all emails for a contact "  # 16.10.23 Olha
+            "  - email [name]: Shows all emails for a contact\n"  # 16.10.23 Olha
+            "  - import [file] / export [file]: Load or save contacts as .csv, .jsonl or .vcf.\n"
+            "  - duplicates: List contacts that share a phone, email or name.\n"
+            "  - merge [name] [name] ...: Combine contacts into the first one.\n"
 
         )
 
@@ -595,6 +1688,47 @@ def handle_command(address_book, command):
         return "Unknown command"
 
 
+    elif action == "duplicates":
+        duplicates = address_book.find_duplicates()
+        if not duplicates:
+            return "No duplicate contacts found."
+        lines = [f"{len(duplicates)} groups of possible duplicates:"]
+        lines += ["  " + ", ".join(names) for names in duplicates]
+        lines.append("Use 'merge [name] [name] ...' to combine a group into the first contact.")
+        return "\n".join(lines)
+
+    elif action == "merge":
+        if len(args) < 2:
+            return "Invalid format for 'merge' command. Please provide at least two names."
+        missing = [name for name in args if address_book.find(name) is None]
+        if missing:
+            return f"Contact {', '.join(missing)} not found"
+        record = address_book.merge_contacts(list(dict.fromkeys(args)))
+        address_book.save_to_file()
+        phones_str = ', '.join([p.get_value() for p in record.phones])
+        return f"Contacts merged into {args[0]}: {phones_str}"
+
+    elif action in ("import", "export"):
+        # file paths keep their case
+        raw_args = command.split()[1:]
+        if not raw_args:
+            return f"Invalid format for '{action}' command. Please provide a .csv, .jsonl or .vcf file."
+        filename = ' '.join(raw_args)
+        try:
+            if action == "export":
+                count = address_book.export_contacts(filename)
+                return f"{count} contacts exported to {filename}"
+            imported, errors = address_book.import_contacts(filename)
+        except (OSError, ValueError) as e:
+            return f"Error: {str(e)}"
+        response = f"{imported} contacts imported from {filename}"
+        if errors:
+            response += f", {len(errors)} rows skipped:\n"
+            response += "\n".join(f"  line {line}: {error}" for line, error in errors[:10])
+            if len(errors) > 10:
+                response += f"\n  ... and {len(errors) - 10} more"
+        return response
+
     elif action == "hello":
         return "How can I help you?"
 
@@ -656,9 +1790,11 @@ def main():
 
         if user_input.lower() in ["goodbye", "close", "exit"]:
             address_book.save_to_file()  # Save the data before exiting
+            address_book.close()
             #print("Good bye!")
             break  # Exit the loop and end the program
 
        
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # the sorter unpacks archives in worker processes
     main()
@@ -0,0 +1,208 @@
+"""
+Append-only change logs kept next to a snapshot file.
+
+The address book and the notebook both save a change as one small record
+at the end of a log and fold the log into a fresh snapshot once it grows
+as big as the data. Journal does the appending, the crash recovery and
+the freezing and swapping around a compaction; what a record means and
+how the snapshot is written is up to them.
+"""
+import os
+import struct
+import threading
+import zlib
+
+FRAME = struct.Struct('<IBI')  # payload length, operation, CRC32 of the payload
+FSYNC_BATCH = 32  # records written between two fsync calls
+COMPACT_MIN_RECORDS = 1000  # logs shorter than this are never compacted
+_NONE_LENGTH = 0xFFFFFFFF
+
+
+def pack_strings(values):
+    parts = [struct.pack('<I', len(values))]
+    for value in values:
+        if value is None:
+            parts.append(struct.pack('<I', _NONE_LENGTH))
+        else:
+            raw = str(value).encode('utf-8')
+            parts.append(struct.pack('<I', len(raw)))
+            parts.append(raw)
+    return b''.join(parts)
+
+
+def unpack_strings(buffer, offset=0):
+    count, = struct.unpack_from('<I', buffer, offset)
+    offset += 4
+    values = []
+    for _ in range(count):
+        length, = struct.unpack_from('<I', buffer, offset)
+        offset += 4
+        if length == _NONE_LENGTH:
+            values.append(None)
+        else:
+            if offset + length > len(buffer):
+                raise ValueError('string runs past the end of the record')
+            values.append(bytes(buffer[offset:offset + length]).decode('utf-8'))
+            offset += length
+    return values, offset
+
+
+def frame(operation, payload):
+    return FRAME.pack(len(payload), operation, zlib.crc32(payload)) + payload
+
+
+class Journal:
+    """
+    The log of changes to the snapshot filename, in log_filename, and the
+    log frozen by a compaction that has not finished, next to it.
+
+    Records are (operation, payload) pairs, and a log starts with magic.
+    """
+    def __init__(self, filename, log_filename, magic):
+        self.filename = filename
+        self.log_filename = log_filename
+        self.frozen_filename = log_filename + '.old'
+        self.magic = magic
+        self.records = 0  # in the log, the frozen one included until it is dropped
+        self.lock = threading.Lock()  # held while records are appended or the log is frozen
+        self._file = None
+        self._unsynced = 0
+        self._compaction = None
+        self._compacted = None
+
+    def append(self, records):
+        """Append the (operation, payload) records and flush them, fsync every FSYNC_BATCH."""
+        if self._file is None:
+            self._file = open(self.log_filename, 'ab')
+            if self._file.tell() == 0:
+                self._file.write(self.magic)
+        written = 0
+        for operation, payload in records:
+            self._file.write(frame(operation, payload))
+            written += 1
+        self._file.flush()
+        self.records += written
+        self._unsynced += written
+        if self._unsynced >= FSYNC_BATCH:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._unsynced = 0
+
+    def should_compact(self, size):
+        """Whether the log holds as many records as the size of the data, and enough to bother."""
+        return self.records >= max(COMPACT_MIN_RECORDS, size)
+
+    def freeze(self):
+        """Move the log aside, so new records go to a new one while a snapshot is written."""
+        self.close()
+        if os.path.exists(self.log_filename):
+            if os.path.exists(self.frozen_filename):
+                # a previous compaction failed, keep its records in front
+                with open(self.log_filename, 'rb') as src, open(self.frozen_filename, 'ab') as dst:
+                    dst.write(src.read()[len(self.magic):])
+                os.remove(self.log_filename)
+            else:
+                os.replace(self.log_filename, self.frozen_filename)
+        self.records = 0
+
+    def compact(self, take_snapshot, write, finish, background=False):
+        """
+        Freeze the log and write a new snapshot.
+
+        take_snapshot() is called with the lock held, right after the log
+        is frozen, and what it returns is passed to write(), on a thread
+        when background. What write() returns goes to finish() on the
+        thread that calls wait(), or right away; finish() swaps the new
+        snapshot in and returns True once the frozen log can be dropped.
+        """
+        self.wait()
+        with self.lock:
+            self.freeze()
+            snapshot = take_snapshot()
+        if background:
+            self._compaction = threading.Thread(target=self._write, args=(snapshot, write, finish), daemon=True)
+            self._compaction.start()
+        else:
+            self._write(snapshot, write, finish)
+            self._finish()
+
+    def _write(self, snapshot, write, finish):
+        try:
+            self._compacted = (write(snapshot), finish)
+        except Exception as e:
+            print(f'Error compacting {self.filename}: {e}')
+
+    def _finish(self):
+        compacted, self._compacted = self._compacted, None
+        if compacted is None:
+            return
+        written, finish = compacted
+        try:
+            if finish(written) and os.path.exists(self.frozen_filename):
+                os.remove(self.frozen_filename)
+        except Exception as e:
+            print(f'Error compacting {self.filename}: {e}')
+
+    def wait(self, block=True):
+        """Finish a background compaction; without block, only if it is done already."""
+        if self._compaction is not None:
+            if not block and self._compaction.is_alive():
+                return
+            self._compaction.join()
+            self._compaction = None
+            self._finish()
+
+    def replay(self, apply):
+        """
+        Call apply(operation, payload) for every record of the frozen log
+        and then of the log.
+
+        apply() has to decode the whole payload before it changes anything
+        and raise ValueError (or struct.error) if it cannot. The first
+        record that is cut short, fails its checksum or cannot be decoded
+        is taken as the torn tail of a crash, and the log is cut there so
+        later records are appended after the last good one.
+        """
+        self.records = 0
+        for log_filename in (self.frozen_filename, self.log_filename):
+            try:
+                self._replay(log_filename, apply)
+            except Exception as e:
+                print(f'Error reading from {log_filename}: {e}')
+
+    def _replay(self, log_filename, apply):
+        try:
+            with open(log_filename, 'rb') as file:
+                buffer = file.read()
+        except FileNotFoundError:
+            return
+        if not buffer.startswith(self.magic):
+            raise ValueError(f'not a log of {self.filename}')
+
+        offset = len(self.magic)
+        while offset + FRAME.size <= len(buffer):
+            length, operation, checksum = FRAME.unpack_from(buffer, offset)
+            start = offset + FRAME.size
+            if start + length > len(buffer):
+                break
+            payload = memoryview(buffer)[start:start + length]
+            if zlib.crc32(payload) != checksum:
+                break
+            try:
+                apply(operation, payload)
+            except (struct.error, TypeError, ValueError):
+                break
+            offset = start + length
+            self.records += 1
+
+        if offset < len(buffer):
+            print(f'{log_filename}: dropped {len(buffer) - offset} bytes of a torn record')
+            with open(log_filename, 'r+b') as file:
+                file.truncate(offset)
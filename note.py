@@ -1,84 +1,585 @@
 import datetime
+import math
+import os
 import pickle
+import re
+import struct
+import threading
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict
+from journal import Journal, pack_strings, unpack_strings
+
+TOKEN_PATTERN = re.compile(r'\w+')
+TITLE_WEIGHT = 2  # a word in the title counts as much as this many in the text
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+NOTES_FILE = 'notes.db'
+LEGACY_NOTES_FILE = 'notes.pkl'  # the whole notebook pickled, as older versions saved it
+# Segment: magic, the text of every note, then the footer with every note's
+# FOOTER_ENTRY, created_at, title and tags, and the trailer. Listing notes
+# needs the footer only, texts are read when asked for.
+SEGMENT_MAGIC = b'NOTESEG1'
+SEGMENT_TRAILER = struct.Struct('<QII8s')  # footer position, notes, next note ID, magic
+FOOTER_ENTRY = struct.Struct('<IQI')  # note ID, text position, text length
+BODY_CACHE_BYTES = 4 * 1024 * 1024  # note texts kept in memory after reading them
+# Log: magic, then a frame per change since the segment was written
+LOG_MAGIC = b'NOTELOG1'
+LOG_PUT = 1
+LOG_DELETE = 2
+LOG_CLEAR = 3
+
+def tokenize(text):
+    """Case-folded words of text."""
+    return TOKEN_PATTERN.findall(text.casefold())
+
+def _note_tokens(note):
+    tokens = tokenize(note.title) * TITLE_WEIGHT + tokenize(note.text)
+    for tag in note.tags:
+        tokens += tokenize(tag)
+    return tokens
+
+def _note_fields(note):
+    return note.id, note.created_at, note.title, note.text, list(note.tags)
+
+def _encode_note(note_id, created_at, title, text, tags):
+    return struct.pack('<I', note_id) + pack_strings([created_at.isoformat(), title, text]) + pack_strings(tags)
+
+def _decode_note(buffer, offset=0):
+    note_id, = struct.unpack_from('<I', buffer, offset)
+    (created_at, title, text), offset = unpack_strings(buffer, offset + 4)
+    tags, offset = unpack_strings(buffer, offset)
+    note = Note(title, text, tags, note_id)
+    note.created_at = datetime.datetime.fromisoformat(created_at)
+    return note
+
+def _segment_fields(note):
+    # the text itself, or where it still is on disk
+    return note.id, note.created_at, note.title, list(note.tags), note._body or note._text
+
+def write_segment(filename, snapshot, next_id):
+    """
+    Write the notes in snapshot, as _segment_fields() tuples, to a new
+    segment. Returns the (position, length) of every text in it.
+    """
+    footer = []
+    bodies = []
+    with open(filename, 'wb') as file:
+        file.write(SEGMENT_MAGIC)
+        for note_id, created_at, title, tags, body in snapshot:
+            if isinstance(body, str):
+                raw = body.encode('utf-8')
+            else:
+                segment, position, length = body
+                raw = segment.read(position, length)
+            position = file.tell()
+            file.write(raw)
+            bodies.append((position, len(raw)))
+            footer.append(FOOTER_ENTRY.pack(note_id, position, len(raw))
+                          + pack_strings([created_at.isoformat(), title]) + pack_strings(tags))
+        footer_position = file.tell()
+        file.write(b''.join(footer))
+        file.write(SEGMENT_TRAILER.pack(footer_position, len(footer), next_id, SEGMENT_MAGIC))
+        file.flush()
+        os.fsync(file.fileno())
+    return bodies
+
+class SegmentFile:
+    """
+    An open segment. Note texts are read from it on demand and the most
+    recently read ones are kept, up to BODY_CACHE_BYTES.
+    """
+    def __init__(self, filename, cache_bytes=BODY_CACHE_BYTES):
+        self.file = open(filename, 'rb')
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()  # compaction reads from another thread
+
+    def load_notes(self):
+        """The notes in the footer, with their texts left on disk, and the next note ID."""
+        self.file.seek(0, os.SEEK_END)
+        end = self.file.tell() - SEGMENT_TRAILER.size
+        if end < len(SEGMENT_MAGIC):
+            raise ValueError('not a notes segment')
+        self.file.seek(end)
+        footer, count, next_id, magic = SEGMENT_TRAILER.unpack(self.file.read(SEGMENT_TRAILER.size))
+        if magic != SEGMENT_MAGIC:
+            raise ValueError('notes segment without a footer')
+        self.file.seek(footer)
+        buffer = self.file.read(end - footer)
+
+        notes = []
+        offset = 0
+        for _ in range(count):
+            note_id, position, length = FOOTER_ENTRY.unpack_from(buffer, offset)
+            (created_at, title), offset = unpack_strings(buffer, offset + FOOTER_ENTRY.size)
+            tags, offset = unpack_strings(buffer, offset)
+            note = Note(title, None, tags, note_id)
+            note.created_at = datetime.datetime.fromisoformat(created_at)
+            note._body = (self, position, length)
+            notes.append(note)
+        return notes, next_id
+
+    def read(self, position, length):
+        with self._lock:
+            self.file.seek(position)
+            return self.file.read(length)
+
+    def text(self, position, length):
+        if not length:
+            # an empty text starts where the next one does, it has no cache entry
+            return ''
+        with self._lock:
+            cached = self._cache.get(position)
+            if cached is not None:
+                self._cache.move_to_end(position)
+                return cached[0]
+        text = self.read(position, length).decode('utf-8')
+        with self._lock:
+            self._cache[position] = (text, length)
+            self._cached_bytes += length
+            while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+                self._cached_bytes -= self._cache.popitem(last=False)[1][1]
+        return text
+
+    def close(self):
+        self.file.close()
+
+    def reopen(self):
+        self.file = open(self.file.name, 'rb')
+
+def _parse_query(query):
+    """
+    Groups of (word, prefix) that must all match; any group will do. Groups
+    are separated by OR, AND is optional and a trailing * makes a prefix.
+    """
+    groups = [[]]
+    for word in query.split():
+        if word == 'OR':
+            groups.append([])
+            continue
+        if word == 'AND':
+            continue
+        terms = tokenize(word)
+        for position, term in enumerate(terms):
+            groups[-1].append((term, word.endswith('*') and position == len(terms) - 1))
+    return [group for group in groups if group]
 
 class Note:
-    def __init__(self, title, text, tags=None):
+    id = None  # notes pickled before they had IDs get one when loaded
+    _body = None  # (segment, position, length) of a text not read yet
+
+    def __init__(self, title, text, tags=None, note_id=None):
+        self.id = note_id
         self.title = title
         self.text = text
         self.tags = [] if tags is None else tags
         self.created_at = datetime.datetime.now()
 
+    @property
+    def text(self):
+        if self._body is not None:
+            segment, position, length = self._body
+            return segment.text(position, length)
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        self._text = value
+        self._body = None
+
+    def __setstate__(self, state):
+        # pickled by older versions, with the text as a plain attribute
+        state = dict(state)
+        if 'text' in state:
+            state['_text'] = state.pop('text')
+        self.__dict__.update(state)
+
+    def summary(self):
+        """The note without its text."""
+        date_str = self.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        tags_str = f"[Tags: {', '.join(self.tags)}]" if self.tags else ""
+        return f'[{date_str}] {self.title} {tags_str}'
+
     def __repr__(self):
         date_str = self.created_at.strftime('%Y-%m-%d %H:%M:%S')
         tags_str = f"[Tags: {', '.join(self.tags)}]" if self.tags else ""
         return f'[{date_str}] {self.title} - {self.text} {tags_str}'
 
 class Notebook:
-    def __init__(self):
-        self.notes = []
+    """
+    Notes by their ID. IDs are never reused, and the notes come in the
+    order they were created.
+    """
+    def __init__(self, filename=NOTES_FILE):
+        self.filename = filename
+        self.notes = {}
+        self._next_id = 1
+        self._dirty = {}
+        self._cleared = False
+        self._log = Journal(filename, filename + '.log', LOG_MAGIC)
+        self._segment = None
+        self._drop_indexes()
 
     def add(self, title, text, tags=None):
-        note = Note(title, text, tags)
-        self.notes.append(note)
+        note = Note(title, text, tags, self._next_id)
+        self._next_id += 1
+        self.notes[note.id] = note
+        self.touch(note)
+        return note
 
-    def delete(self, index):
-        if 0 <= index < len(self.notes):
-            del self.notes[index]
-        else:
-            print("Invalid note index!")
+    def get(self, note_id):
+        return self.notes.get(note_id)
+
+    def delete(self, note_id):
+        note = self.notes.pop(note_id, None)
+        if note is None:
+            print("Invalid note ID!")
+            return False
+        self._dirty[note_id] = None
+        if self._postings is not None:
+            self._unindex(note)
+        if self._tag_notes is not None:
+            self._untag(note)
+        return True
+
+    def touch(self, note):
+        """
+        Mark a new or changed note, so the next save writes it, and bring
+        the indexes up to date with it.
+        """
+        self._dirty[note.id] = None
+        if self._postings is not None:
+            self._unindex(note)
+            self._index(note)
+        if self._tag_notes is not None:
+            self._untag(note)
+            self._tag(note)
 
     def list_notes(self):
-        for index, note in enumerate(self.notes):
-            print(f"{index}. {note}")
+        # titles and tags only, the texts stay on disk
+        for note in self.notes.values():
+            print(f"{note.id}. {note.summary()}")
 
     def clear_all(self):
-        self.notes = []
+        self.notes = {}
+        self._dirty.clear()
+        self._cleared = True
+        self._drop_indexes()
+
+    def edit(self, note_id, new_title=None, new_text=None, new_tags=None):
+        note = self.notes.get(note_id)
+        if note is None:
+            return False
+        if new_title:
+            note.title = new_title
+        if new_text:
+            note.text = new_text
+        if new_tags is not None:
+            note.tags = new_tags
+        self.touch(note)
+        return True
 
-    def edit(self, index, new_title=None, new_text=None, new_tags=None):
+    def save_to_file(self):
+        """
+        Append the notes changed since the last save to the log, one small
+        record each. compact() folds the log into a new segment once it
+        grows as big as the notebook.
+        """
+        self._log.wait(block=False)
         try:
-            note = self.notes[index]
-            if new_title:
-                note.title = new_title
-            if new_text:
-                note.text = new_text
-            if new_tags is not None:
-                note.tags = new_tags
-            return True
-        except IndexError:
+            if self._cleared or self._dirty:
+                self._log.append(self._dirty_records())
+                self._dirty.clear()
+                self._cleared = False
+        except Exception as e:
+            print(f"Error saving notes to {self.filename}: {e}")
+            return
+
+        if self._log.should_compact(len(self.notes)):
+            self.compact(background=True)
+
+    def _dirty_records(self):
+        if self._cleared:
+            yield LOG_CLEAR, struct.pack('<I', self._next_id)
+        for note_id in self._dirty:
+            note = self.notes.get(note_id)
+            if note is None:
+                yield LOG_DELETE, struct.pack('<I', note_id)
+            else:
+                yield LOG_PUT, _encode_note(*_note_fields(note))
+
+    def compact(self, background=False):
+        """
+        Write every note to a new segment and drop the log. The log is
+        frozen first, so saves go on to a new one in the meantime.
+        """
+        self._log.compact(self._take_snapshot, self._write_segment, self._finish_compaction, background)
+
+    def _take_snapshot(self):
+        self._dirty.clear()
+        self._cleared = False
+        return [_segment_fields(note) for note in self.notes.values()], self._next_id
+
+    def _write_segment(self, snapshot):
+        notes, next_id = snapshot
+        return notes, write_segment(self.filename + '.tmp', notes, next_id)
+
+    def _finish_compaction(self, compacted):
+        # swapping files happens on the main thread, while nothing reads texts
+        old_segment = self._segment
+        replaced = False
+        try:
+            if old_segment is not None:
+                # Windows will not replace a file that is still open
+                old_segment.close()
+            os.replace(self.filename + '.tmp', self.filename)
+            replaced = True
+            self._segment = SegmentFile(self.filename)
+        except Exception as e:
+            print(f"Error compacting {self.filename}: {e}")
+            if old_segment is not None and not replaced:
+                old_segment.reopen()
             return False
+        # texts not changed since the snapshot are read from the new segment
+        # from now on, and no longer held in memory
+        snapshot, bodies = compacted
+        for (note_id, created_at, title, tags, body), (position, length) in zip(snapshot, bodies):
+            note = self.notes.get(note_id)
+            if note is not None and (note._body or note._text) is body:
+                note._body = (self._segment, position, length)
+                note._text = None
+        return True
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
 
-    def save_to_file(self, filename="notes.pkl"):
-        with open(filename, 'wb') as file:
-            pickle.dump(self.notes, file)
+    def close(self):
+        self._log.wait()
+        self._log.close()
+        self._close_segment()
 
-    def load_from_file(self, filename="notes.pkl"):
+    def load_from_file(self, legacy_filename=LEGACY_NOTES_FILE):
+        """
+        Read the notes from the segment footer and replay the log on top of
+        it; texts are read when they are needed. Without a segment, notes
+        pickled by an older version into legacy_filename are converted
+        once; that file is left as it was.
+        """
+        self._log.wait()
+        self._log.close()
+        self._close_segment()
+        self.notes = {}
+        self._next_id = 1
+        self._dirty.clear()
+        self._cleared = False
+        self._drop_indexes()
+        convert = False
         try:
-            with open(filename, 'rb') as file:
-                self.notes = pickle.load(file)
+            self._segment = SegmentFile(self.filename)
+            notes, self._next_id = self._segment.load_notes()
+            self.notes = {note.id: note for note in notes}
         except FileNotFoundError:
-            pass
+            if not os.path.exists(self._log.log_filename) and os.path.exists(legacy_filename):
+                convert = self._load_legacy(legacy_filename)
+        except Exception as e:
+            print(f"Error reading notes from {self.filename}: {e}")
 
-    def search(self, keyword):
-        matching_notes = []
-        for note in self.notes:
-            if keyword in note.title or keyword in note.text or keyword in note.tags:
-                matching_notes.append(note)
-        return matching_notes
+        self._log.replay(self._apply_log_record)
+        if convert:
+            self.compact()
+        if convert:
+            print(f"Notes converted to {self.filename}.")
 
-    def add_tag(self, index, tag):
+    def _load_legacy(self, legacy_filename):
         try:
-            note = self.notes[index]
-            if tag:
-                note.tags.append(tag)
-            return True
-        except IndexError:
+            with open(legacy_filename, 'rb') as file:
+                notes = pickle.load(file)
+        except Exception as e:
+            print(f"Error reading notes from {legacy_filename}: {e}")
             return False
+        self._next_id = max((note.id for note in notes if note.id is not None), default=0) + 1
+        for note in sorted(notes, key=lambda note: note.created_at):
+            if note.id is None:
+                note.id = self._next_id
+                self._next_id += 1
+            self.notes[note.id] = note
+        return True
+
+    def _apply_log_record(self, operation, payload):
+        if operation == LOG_PUT:
+            note = _decode_note(payload)
+            self.notes[note.id] = note
+            self._next_id = max(self._next_id, note.id + 1)
+        elif operation == LOG_DELETE:
+            note_id, = struct.unpack_from('<I', payload)
+            self.notes.pop(note_id, None)
+        elif operation == LOG_CLEAR:
+            next_id, = struct.unpack_from('<I', payload)
+            self.notes.clear()
+            self._next_id = max(self._next_id, next_id)
+        else:
+            raise ValueError(f"unknown log operation {operation}")
+
+    def search(self, query, prefix=True):
+        """
+        Notes containing the words of query in their title, text or tags,
+        best BM25 match first. Case does not matter, and with prefix every
+        word also matches the longer words it starts. 'a b OR c' finds notes
+        with both a and b, or with c.
+        """
+        groups = _parse_query(query)
+        if not groups:
+            return []
+        self._build_search_index()
+
+        scores = {}
+        for group in groups:
+            words = [self._expand(term, prefix or is_prefix) for term, is_prefix in group]
+            words.sort(key=lambda terms: sum(len(self._postings[term]) for term in terms))
+            matches = None
+            for terms in words:
+                note_ids = set().union(*(self._postings[term] for term in terms))
+                matches = note_ids if matches is None else matches & note_ids
+                if not matches:
+                    break
+            group_scores = dict.fromkeys(matches, 0)
+            for terms in words:
+                for term in terms:
+                    self._add_scores(term, group_scores)
+            for note_id, score in group_scores.items():
+                if score > scores.get(note_id, -1):
+                    scores[note_id] = score
+        ranked = sorted(scores, key=lambda note_id: (-scores[note_id], note_id))
+        return [self.notes[note_id] for note_id in ranked]
+
+    def _expand(self, term, prefix):
+        if not prefix:
+            return [term] if term in self._postings else []
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._postings)
+        terms = []
+        for position in range(bisect_left(self._sorted_terms, term), len(self._sorted_terms)):
+            if not self._sorted_terms[position].startswith(term):
+                break
+            terms.append(self._sorted_terms[position])
+        return terms
+
+    def _add_scores(self, term, scores):
+        """Add the BM25 score of term to the score of every note in scores."""
+        postings = self._postings[term]
+        count = len(self._lengths)
+        idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+        average_length = self._total_length / count
+        lengths = self._lengths
+        # iterate over the smaller side, a rare word or a narrow AND
+        note_ids = postings if len(postings) < len(scores) else scores
+        for note_id in note_ids:
+            frequency = postings.get(note_id)
+            if frequency and note_id in scores:
+                length_ratio = lengths[note_id] / average_length
+                scores[note_id] += idf * frequency * (BM25_K1 + 1) / (
+                    frequency + BM25_K1 * (1 - BM25_B + BM25_B * length_ratio))
+
+    def _drop_indexes(self):
+        # built on first use, kept up to date by touch() from then on
+        self._postings = None
+        self._tag_notes = None
+
+    def _build_search_index(self):
+        if self._postings is not None:
+            return
+        self._postings = defaultdict(dict)
+        self._note_terms = {}
+        self._lengths = {}
+        self._total_length = 0
+        self._sorted_terms = None
+        for note in self.notes.values():
+            self._index(note)
+
+    def _index(self, note):
+        tokens = _note_tokens(note)
+        counts = Counter(tokens)
+        self._note_terms[note.id] = counts
+        self._lengths[note.id] = len(tokens)
+        self._total_length += len(tokens)
+        postings = self._postings
+        known_terms = len(postings)
+        for term, count in counts.items():
+            postings[term][note.id] = count
+        if len(postings) != known_terms:
+            self._sorted_terms = None
+
+    def _unindex(self, note):
+        counts = self._note_terms.pop(note.id, None)
+        if counts is None:
+            return
+        self._total_length -= self._lengths.pop(note.id)
+        for term in counts:
+            postings = self._postings[term]
+            del postings[note.id]
+            if not postings:
+                del self._postings[term]
+                self._sorted_terms = None
+
+    def add_tag(self, note_id, tag):
+        note = self.notes.get(note_id)
+        if note is None:
+            return False
+        if tag:
+            note.tags.append(tag)
+            self.touch(note)
+        return True
 
     def list_tags(self):
-        all_tags = set()
-        for note in self.notes:
-            all_tags.update(note.tags)
-        return list(all_tags)
+        self._build_tag_index()
+        return list(self._tag_notes)
+
+    def tag_counts(self):
+        """(tag, number of notes with it) pairs, most used first."""
+        self._build_tag_index()
+        return sorted(((tag, len(note_ids)) for tag, note_ids in self._tag_notes.items()),
+                      key=lambda item: (-item[1], item[0]))
+
+    def tagged(self, tags, match_all=True):
+        """
+        Notes with every one of tags, or with any of them when match_all is
+        off, oldest first.
+        """
+        self._build_tag_index()
+        postings = sorted((self._tag_notes.get(tag, {}) for tag in set(tags)), key=len)
+        if not postings:
+            return []
+        if match_all:
+            note_ids = [note_id for note_id in postings[0] if all(note_id in other for other in postings[1:])]
+        else:
+            note_ids = set().union(*postings)
+        # IDs are handed out in the order notes are created
+        return [self.notes[note_id] for note_id in sorted(note_ids)]
+
+    def _build_tag_index(self):
+        if self._tag_notes is not None:
+            return
+        self._tag_notes = {}
+        self._note_tags = {}
+        for note in self.notes.values():
+            self._tag(note)
+
+    def _tag(self, note):
+        tags = tuple(dict.fromkeys(note.tags))
+        self._note_tags[note.id] = tags
+        for tag in tags:
+            self._tag_notes.setdefault(tag, set()).add(note.id)
+
+    def _untag(self, note):
+        for tag in self._note_tags.pop(note.id, ()):
+            note_ids = self._tag_notes[tag]
+            note_ids.discard(note.id)
+            if not note_ids:
+                del self._tag_notes[tag]
 
 def input_with_retry(prompt, validation_func=None, error_message="Invalid input!"):
     while True:
@@ -92,8 +593,9 @@ def notebook_interface():
     notebook.load_from_file()
     while True:
         command = input_with_retry(
-            "\nChoose an option in notes ('add', 'search', 'delete', 'edit', 'list', 'clear', 'tags', 'exit'): ",
-            lambda x: x in ['add', 'delete', 'edit', 'list', 'clear', 'exit', 'search', 'tags']
+            "\nChoose an option in notes ('add', 'search', 'delete', 'edit', 'list', 'clear', 'tags', 'tagged', "
+            "'exit'): ",
+            lambda x: x in ['add', 'delete', 'edit', 'list', 'clear', 'exit', 'search', 'tags', 'tagged']
         ).strip().lower()
 
         if command == 'add':
@@ -106,12 +608,12 @@ def notebook_interface():
 
         elif command == 'edit':
             notebook.list_notes()
-            index = input_with_retry(
-                "Enter the index of the note you want to edit: ",
-                lambda x: x.isdigit() and 0 <= int(x) < len(notebook.notes),
-                "Please enter a valid index!"
+            note_id = input_with_retry(
+                "Enter the ID of the note you want to edit: ",
+                lambda x: x.isdigit() and int(x) in notebook.notes,
+                "Please enter a valid ID!"
             )
-            index = int(index)
+            note_id = int(note_id)
 
             new_title = input("Enter new title (leave blank to keep current): ")
             if not new_title:
@@ -124,30 +626,30 @@ def notebook_interface():
             new_tags = input("Enter new tags (comma separated, leave blank for none): ").split(',')
             new_tags = [tag.strip() for tag in new_tags if tag.strip()]
 
-            if notebook.edit(index, new_title, new_text, new_tags):
+            if notebook.edit(note_id, new_title, new_text, new_tags):
                 print("Note updated successfully!")
             else:
-                print("Invalid index!")
+                print("Invalid ID!")
             notebook.save_to_file()
 
         elif command == 'delete':
             notebook.list_notes()
-            index = input_with_retry(
-                "Enter note index to delete: ",
-                lambda x: x.isdigit() and 0 <= int(x) < len(notebook.notes),
-                "Please enter a valid index!"
+            note_id = input_with_retry(
+                "Enter the ID of the note to delete: ",
+                lambda x: x.isdigit() and int(x) in notebook.notes,
+                "Please enter a valid ID!"
             )
-            index = int(index)
-            notebook.delete(index)
+            notebook.delete(int(note_id))
             notebook.save_to_file()
 
         elif command == 'search':
-            keyword = input_with_retry("Enter a keyword to search for: ", lambda x: x != "")
+            keyword = input_with_retry("Enter words to search for (put OR between alternatives): ",
+                                       lambda x: x != "")
             matching_notes = notebook.search(keyword)
             if matching_notes:
                 print("Matching notes:")
                 for note in matching_notes:
-                    print(note)
+                    print(f"{note.id}. {note}")
             else:
                 print("No matching notes found.")
 
@@ -160,13 +662,25 @@ def notebook_interface():
             notebook.save_to_file()
 
         elif command == 'tags':
-            tags = notebook.list_tags()
+            tags = notebook.tag_counts()
             if tags:
-                print("Tags: ", ', '.join(tags))
+                print("Tags: ", ', '.join(f"{tag} ({count})" for tag, count in tags))
             else:
                 print("No tags found.")
 
+        elif command == 'tagged':
+            tags = input_with_retry("Enter tags (comma separated): ", lambda x: x.strip(",\t ") != "").split(',')
+            tags = [tag.strip() for tag in tags if tag.strip()]
+            match_all = input("Notes with all of these tags or with any? (all/any): ").strip().lower() != 'any'
+            matching_notes = notebook.tagged(tags, match_all)
+            if matching_notes:
+                for note in matching_notes:
+                    print(f"{note.id}. {note}")
+            else:
+                print("No notes with these tags.")
+
         elif command == 'exit':
+            notebook.close()
             break
 
 if __name__ == '__main__':
@@ -1,29 +1,190 @@
 import os
 import shutil
 import re
+import multiprocessing
+import threading
+import json
+import sys
+import time
+import hashlib
+import mmap
+import gzip
+import tarfile
+import zipfile
+from contextlib import nullcontext
+from stat import S_ISDIR
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # FolderWatcher polls instead
+    FileSystemEventHandler = object
+    Observer = None
+
+CATEGORIES = {
+    'images': ('JPEG', 'PNG', 'JPG', 'SVG'),
+    'video': ('AVI', 'MP4', 'MOV', 'MKV'),
+    'documents': ('DOC', 'DOCX', 'TXT', 'PDF', 'XLSX', 'PPTX'),
+    'audio': ('MP3', 'OGG', 'WAV', 'AMR'),
+    'archives': ('ZIP', 'GZ', 'TAR', 'RAR'),
+}
+OTHER = 'other'
+CATEGORY_DIRS = (*CATEGORIES, OTHER)
+# (offset, signature, category) for telling what a file without an extension holds
+MAGIC_NUMBERS = (
+    (0, b'\xff\xd8\xff', 'images'),
+    (0, b'\x89PNG\r\n\x1a\n', 'images'),
+    (0, b'GIF8', 'images'),
+    (0, b'%PDF-', 'documents'),
+    (0, b'PK\x03\x04', 'archives'),
+    (0, b'\x1f\x8b', 'archives'),
+    (0, b'Rar!\x1a\x07', 'archives'),
+    (257, b'ustar', 'archives'),
+    (0, b'ID3', 'audio'),
+    (0, b'OggS', 'audio'),
+    (8, b'WAVE', 'audio'),
+    (8, b'AVI ', 'video'),
+    (4, b'ftyp', 'video'),
+    (0, b'\x1a\x45\xdf\xa3', 'video'),
+)
+SNIFF_BYTES = 512
+SORT_RULES_PATH = os.path.join(os.path.expanduser('~'), '.sort_rules.json')
+SORT_STATE_DIR = os.path.join(os.path.expanduser('~'), '.sort_state')  # checkpoints, hash caches and saved plans
+PLAN_VERSION = 1
+PROGRESS_INTERVAL = 1.0  # seconds between two progress lines
+PENDING_MOVES_PER_WORKER = 4  # moves queued per worker before the scan waits for them
+PARTIAL_HASH_BYTES = 64 * 1024  # read from the start of every same-sized file before hashing it whole
+DEDUP_MODES = ('drop', 'link')
+UNPACK_CHUNK_BYTES = 1024 * 1024
+MAX_UNPACKED_BYTES = 4 * 1024 ** 3  # per archive
+MAX_UNPACK_RATIO = 100  # unpacked bytes per archive byte
+MIN_UNPACK_LIMIT = 16 * 1024 * 1024  # small archives may still hold this much
+MAX_ARCHIVE_MEMBERS = 100000
+WATCH_INTERVAL = 1.0  # seconds between two looks at a watched folder
+SETTLE_SECONDS = 2.0  # a new file is sorted once its size and mtime stayed the same this long
+PARTIAL_DOWNLOAD_EXTS = ('.part', '.partial', '.crdownload', '.download', '.tmp')
+
+TRANSLIT_MAPPING = {
+    'А': 'A', 'Б': 'B', 'В': 'V', 'Г': 'H', 'Ґ': 'G', 'Д': 'D', 'Е': 'E', 'Є': 'Ye',
+    'Ж': 'Zh', 'З': 'Z', 'И': 'Y', 'І': 'I', 'Ї': 'Yi', 'Й': 'Y', 'К': 'K', 'Л': 'L',
+    'М': 'M', 'Н': 'N', 'О': 'O', 'П': 'P', 'Р': 'R', 'С': 'S', 'Т': 'T', 'У': 'U',
+    'Ф': 'F', 'Х': 'Kh', 'Ц': 'Ts', 'Ч': 'Ch', 'Ш': 'Sh', 'Щ': 'Shch', 'Ю': 'Yu',
+    'Я': 'Ya', 'ь': '', '’': ''
+}
+# one str.translate pass handles both cases of every letter
+TRANSLIT_TABLE = str.maketrans({**TRANSLIT_MAPPING,
+                                **{cyr.lower(): lat.lower() for cyr, lat in TRANSLIT_MAPPING.items()}})
+NOT_LATIN_OR_DIGIT = re.compile(r'[^a-zA-Z0-9]')
+NORMALIZE_CACHE_SIZE = 65536
+
+def transliterate(text):
+    """Cyrillic letters of text spelled with Latin ones, everything else kept."""
+    return text.translate(TRANSLIT_TABLE)
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
 def normalize(name):
-    mapping = {
-        'А': 'A', 'Б': 'B', 'В': 'V', 'Г': 'H', 'Ґ': 'G', 'Д': 'D', 'Е': 'E', 'Є': 'Ye',
-        'Ж': 'Zh', 'З': 'Z', 'И': 'Y', 'І': 'I', 'Ї': 'Yi', 'Й': 'Y', 'К': 'K', 'Л': 'L',
-        'М': 'M', 'Н': 'N', 'О': 'O', 'П': 'P', 'Р': 'R', 'С': 'S', 'Т': 'T', 'У': 'U',
-        'Ф': 'F', 'Х': 'Kh', 'Ц': 'Ts', 'Ч': 'Ch', 'Ш': 'Sh', 'Щ': 'Shch', 'Ю': 'Yu',
-        'Я': 'Ya', 'ь': '', '’': ''
-    }
-    for cyr, lat in mapping.items():
-        name = name.replace(cyr, lat)
-        name = name.replace(cyr.lower(), lat.lower())
+    return NOT_LATIN_OR_DIGIT.sub('_', name.translate(TRANSLIT_TABLE))
+
+class UnsafeArchiveError(ValueError):
+    """An archive UnpackLimits refused to unpack."""
+
+class UnsupportedArchiveError(ValueError):
+    """An archive in a format unpack_to cannot read, RAR for one."""
+
+# retrying does not change the answer for these, the archive stays packed
+NOT_UNPACKABLE = (UnsafeArchiveError, UnsupportedArchiveError, zipfile.BadZipFile, tarfile.TarError,
+                  gzip.BadGzipFile)
+
+class UnpackLimits:
+    """
+    Keeps one archive from unpacking into more than MAX_UNPACK_RATIO times
+    its size (at most MAX_UNPACKED_BYTES), more than MAX_ARCHIVE_MEMBERS
+    members, or anything outside its folder.
+    """
+    def __init__(self, archive_path, unpack_folder):
+        self.archive_path = archive_path
+        self.unpack_folder = os.path.realpath(unpack_folder)
+        archive_size = os.path.getsize(archive_path)
+        self.max_bytes = min(MAX_UNPACKED_BYTES, max(archive_size * MAX_UNPACK_RATIO, MIN_UNPACK_LIMIT))
+        self.unpacked = 0
+        self.members = 0
+
+    def target(self, member_name):
+        self.members += 1
+        if self.members > MAX_ARCHIVE_MEMBERS:
+            raise UnsafeArchiveError(f"{self.archive_path} has more than {MAX_ARCHIVE_MEMBERS} members")
+        target = os.path.realpath(os.path.join(self.unpack_folder, member_name))
+        if os.path.commonpath([target, self.unpack_folder]) != self.unpack_folder:
+            raise UnsafeArchiveError(f"{self.archive_path}: {member_name} points outside the archive")
+        return target
+
+    def copy(self, source, target):
+        """Stream source into the file target, chunk by chunk."""
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as file:
+            while True:
+                chunk = source.read(UNPACK_CHUNK_BYTES)
+                if not chunk:
+                    break
+                self.unpacked += len(chunk)
+                if self.unpacked > self.max_bytes:
+                    raise UnsafeArchiveError(f"{self.archive_path} unpacks to more than {self.max_bytes} bytes")
+                file.write(chunk)
+
+def unpack_zip(archive_path, limits):
+    with zipfile.ZipFile(archive_path) as archive:
+        for member in archive.infolist():
+            target = limits.target(member.filename)
+            if member.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            with archive.open(member) as source:
+                limits.copy(source, target)
 
-    name = re.sub(r'[^a-zA-Z0-9]', '_', name)
-    return name
+def unpack_tar(archive_path, limits):
+    # stream mode reads the (compressed) tarball once, front to back
+    with tarfile.open(archive_path, 'r|*') as archive:
+        for member in archive:
+            target = limits.target(member.name)
+            if member.isdir():
+                os.makedirs(target, exist_ok=True)
+            elif member.isfile():
+                limits.copy(archive.extractfile(member), target)
+            # links and device files are left out
 
-def unpack(archive_path, path_to_unpack):
-    """Распаковка архива и сохранение оригинала."""
-    unpack_folder = os.path.join(path_to_unpack, os.path.splitext(os.path.basename(archive_path))[0])
+def unpack_gzip(archive_path, limits):
+    name = os.path.splitext(os.path.basename(archive_path))[0]
+    with gzip.open(archive_path, 'rb') as source:
+        limits.copy(source, limits.target(name))
+
+def unpack_to(archive_path, unpack_folder):
+    """
+    Unpack archive_path into unpack_folder member by member within
+    UnpackLimits. What was unpacked is removed again if it fails.
+    """
+    created = not os.path.exists(unpack_folder)
     os.makedirs(unpack_folder, exist_ok=True)
-    shutil.unpack_archive(archive_path, unpack_folder)
+    limits = UnpackLimits(archive_path, unpack_folder)
+    try:
+        if zipfile.is_zipfile(archive_path):
+            unpack_zip(archive_path, limits)
+        elif tarfile.is_tarfile(archive_path):
+            unpack_tar(archive_path, limits)
+        elif archive_path.lower().endswith('.gz'):
+            unpack_gzip(archive_path, limits)
+        else:
+            raise UnsupportedArchiveError(f"{archive_path} is not a zip, tar or gzip archive")
+    except BaseException:
+        if created:
+            shutil.rmtree(unpack_folder, ignore_errors=True)
+        raise
+
+def get_unique_name(path, name, ext, registry=None):
+    if registry is not None:
+        return registry.unique_name(path, name, ext)
 
-def get_unique_name(path, name, ext):
     if not os.path.exists(os.path.join(path, name + ext)):
         return name + ext
 
@@ -34,79 +195,848 @@ def get_unique_name(path, name, ext):
         counter += 1
     return new_name + ext
 
-def process_folder(folder_path):
-    image_exts = ('JPEG', 'PNG', 'JPG', 'SVG')
-    video_exts = ('AVI', 'MP4', 'MOV', 'MKV')
-    doc_exts = ('DOC', 'DOCX', 'TXT', 'PDF', 'XLSX', 'PPTX')
-    audio_exts = ('MP3', 'OGG', 'WAV', 'AMR')
-    archive_exts = ('ZIP', 'GZ', 'TAR', 'RAR')
-
-    unpack_archives = input("Do you want to unpack archives? (yes/no): ").strip().lower()
-
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            old_path = os.path.join(root, file)
-            file_name, file_ext = os.path.splitext(file)
-            file_ext = file_ext[1:].upper()
-
-            new_file_name = normalize(file_name) + '.' + file_ext.lower()
-            new_path = os.path.join(root, new_file_name)
-            os.rename(old_path, new_path)
-
-            if file_ext in image_exts:
-                if not os.path.exists(os.path.join(folder_path, 'images')):
-                    os.mkdir(os.path.join(folder_path, 'images'))
-                new_file_name = get_unique_name(os.path.join(folder_path, 'images'), normalize(file_name),
-                                                '.' + file_ext.lower())
-                shutil.move(new_path, os.path.join(folder_path, 'images', new_file_name))
-
-            elif file_ext in video_exts:
-                if not os.path.exists(os.path.join(folder_path, 'video')):
-                    os.mkdir(os.path.join(folder_path, 'video'))
-                new_file_name = get_unique_name(os.path.join(folder_path, 'video'), normalize(file_name),
-                                                '.' + file_ext.lower())
-                shutil.move(new_path, os.path.join(folder_path, 'video', new_file_name))
-
-            elif file_ext in doc_exts:
-                if not os.path.exists(os.path.join(folder_path, 'documents')):
-                    os.mkdir(os.path.join(folder_path, 'documents'))
-                new_file_name = get_unique_name(os.path.join(folder_path, 'documents'), normalize(file_name),
-                                                '.' + file_ext.lower())
-                shutil.move(new_path, os.path.join(folder_path, 'documents', new_file_name))
-
-            elif file_ext in audio_exts:
-                if not os.path.exists(os.path.join(folder_path, 'audio')):
-                    os.mkdir(os.path.join(folder_path, 'audio'))
-                new_file_name = get_unique_name(os.path.join(folder_path, 'audio'), normalize(file_name),
-                                                '.' + file_ext.lower())
-                shutil.move(new_path, os.path.join(folder_path, 'audio', new_file_name))
-
-            elif file_ext in archive_exts:
-                if not os.path.exists(os.path.join(folder_path, 'archives')):
-                    os.mkdir(os.path.join(folder_path, 'archives'))
-                archive_dest_path = os.path.join(folder_path, 'archives', os.path.basename(new_path))
-                shutil.move(new_path, archive_dest_path)
-
-                if unpack_archives == 'yes':
-                    unpack(archive_dest_path, os.path.join(folder_path, 'archives'))
+class NameRegistry:
+    """
+    Names taken in each target folder, read with one os.scandir per folder.
+
+    unique_name() gives the same answers as get_unique_name() without
+    probing the disk, remembers the next free suffix for every name, and
+    can be shared by several threads.
+    """
+    def __init__(self):
+        self._taken = {}
+        self._counters = {}
+        self._lock = threading.RLock()
+
+    def _names(self, path):
+        taken = self._taken.get(path)
+        if taken is None:
+            try:
+                with os.scandir(path) as entries:
+                    taken = {os.path.normcase(entry.name) for entry in entries}
+            except FileNotFoundError:
+                taken = set()
+            self._taken[path] = taken
+        return taken
+
+    def unique_name(self, path, name, ext):
+        with self._lock:
+            taken = self._names(path)
+            new_name = name + ext
+            if os.path.normcase(new_name) in taken:
+                key = (path, name, ext)
+                counter = self._counters.get(key, 1)
+                new_name = f"{name}_{counter}{ext}"
+                while os.path.normcase(new_name) in taken:
+                    counter += 1
+                    new_name = f"{name}_{counter}{ext}"
+                self._counters[key] = counter + 1
+            taken.add(os.path.normcase(new_name))
+            return new_name
+
+    def claim(self, path, file_name):
+        """Take file_name in path, or its next free variant if it is already taken."""
+        with self._lock:
+            taken = self._names(path)
+            if os.path.normcase(file_name) not in taken:
+                taken.add(os.path.normcase(file_name))
+                return file_name
+            return self.unique_name(path, *os.path.splitext(file_name))
+
+def default_workers():
+    return min(32, (os.cpu_count() or 1) + 4)
+
+def sniff_category(path):
+    """The category MAGIC_NUMBERS gives the first bytes of path, or None."""
+    try:
+        with open(path, 'rb') as file:
+            head = file.read(SNIFF_BYTES)
+    except OSError:
+        return None
+    for offset, signature, category in MAGIC_NUMBERS:
+        if head.startswith(signature, offset):
+            return category
+    return None
+
+class Categories:
+    """
+    Which category folder a file goes to, looked up by its extension.
+
+    rules maps a category to its extensions. Files without an extension
+    are recognised by MAGIC_NUMBERS when sniff is on, everything else is
+    OTHER.
+    """
+    def __init__(self, rules=CATEGORIES, sniff=True):
+        self.rules = {category: [ext.lstrip('.').upper() for ext in exts] for category, exts in rules.items()}
+        self.by_extension = {ext: category for category, exts in self.rules.items() for ext in exts}
+        self.sniff = sniff
+        self.dirs = tuple(dict.fromkeys((*self.rules, OTHER)))
+
+    @classmethod
+    def load(cls, rules_path=SORT_RULES_PATH):
+        """
+        The default categories with the rules from a JSON file on top, such
+        as {"books": ["epub", "fb2"], "images": ["heic"]}. An extension
+        listed there leaves its default category. No file, no changes.
+        """
+        try:
+            with open(rules_path, 'r', encoding='utf-8') as file:
+                user_rules = json.load(file)
+        except FileNotFoundError:
+            return cls()
+        if not isinstance(user_rules, dict) or not all(
+                isinstance(exts, list) and all(isinstance(ext, str) for ext in exts)
+                for exts in user_rules.values()):
+            raise ValueError(f"{rules_path} must map category names to lists of extensions")
+        rules = {category: list(exts) for category, exts in CATEGORIES.items()}
+        for category, exts in user_rules.items():
+            exts = [ext.lstrip('.').upper() for ext in exts]
+            for other_exts in rules.values():
+                other_exts[:] = [ext for ext in other_exts if ext not in exts]
+            rules.setdefault(category, []).extend(exts)
+        return cls(rules)
+
+    def category(self, file_ext, path=None):
+        category = self.by_extension.get(file_ext)
+        if category is None and not file_ext and path is not None and self.sniff:
+            category = sniff_category(path)
+        return category or OTHER
+
+DEFAULT_CATEGORIES = Categories()
+
+def move_file(src, dst):
+    shutil.move(src, dst)
+    return dst
+
+class ChangedDuplicateError(ValueError):
+    """A planned duplicate that no longer has the bytes of the file it was to be replaced by."""
+
+def check_duplicate(src, keep, src_key=None, keep_key=None):
+    """
+    Make sure src still has the bytes of keep. Unless both still have the
+    [size, mtime_ns] the plan saw, src_key and keep_key, they are hashed again.
+    """
+    # never lose the last copy
+    if not os.path.exists(keep):
+        raise FileNotFoundError(f"{keep} is gone, keeping its duplicate {src}")
+    src_stat, keep_stat = os.stat(src), os.stat(keep)
+    if src_key is not None and keep_key is not None and \
+            list(entry_key(src_stat)) == list(src_key) and list(entry_key(keep_stat)) == list(keep_key):
+        return
+    size = src_stat.st_size
+    if size != keep_stat.st_size or hash_file(src, size, False) != hash_file(keep, size, False):
+        raise ChangedDuplicateError(f"{src} is no longer a copy of {keep}, leaving it where it is")
+
+def drop_duplicate(src, keep, src_key=None, keep_key=None):
+    check_duplicate(src, keep, src_key, keep_key)
+    os.remove(src)
+    return keep
+
+def link_duplicate(src, keep, dst, src_key=None, keep_key=None):
+    """Replace the duplicate src with a hard link to keep at dst."""
+    check_duplicate(src, keep, src_key, keep_key)
+    try:
+        os.link(keep, dst)
+    except OSError:
+        # another file system or no hard links there, move the copy instead
+        return move_file(src, dst)
+    os.remove(src)
+    return dst
+
+def hash_file(path, size, partial):
+    """
+    Hash the first PARTIAL_HASH_BYTES of the file, or all of it through
+    mmap. A file no longer than PARTIAL_HASH_BYTES hashes the same both ways.
+    """
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as file:
+        if partial or size <= PARTIAL_HASH_BYTES:
+            digest.update(file.read(PARTIAL_HASH_BYTES))
+        else:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                digest.update(data)
+    return digest.hexdigest()
+
+def state_path(folder_path, suffix):
+    """
+    Where something kept about folder_path between runs goes, in
+    SORT_STATE_DIR, so neither the folder nor its parent has to be writable.
+    """
+    folder_path = os.path.abspath(folder_path)
+    key = hashlib.blake2b(os.fsencode(os.path.normcase(folder_path)), digest_size=8).hexdigest()
+    name = os.path.basename(folder_path.rstrip(os.sep)) or 'root'
+    return os.path.join(SORT_STATE_DIR, f"{name}-{key}{suffix}")
+
+def hash_cache_path(folder_path):
+    return state_path(folder_path, '.sort_hashes.json')
+
+def load_hash_cache(folder_path):
+    """{relative path: [size, mtime_ns, partial hash, full hash or None]}"""
+    try:
+        with open(hash_cache_path(folder_path), 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_hash_cache(folder_path, cache):
+    os.makedirs(SORT_STATE_DIR, exist_ok=True)
+    with open(hash_cache_path(folder_path), 'w', encoding='utf-8') as file:
+        json.dump(cache, file, ensure_ascii=False)
+
+def entry_key(stat):
+    return stat.st_size, stat.st_mtime_ns
+
+def find_duplicate_files(folder_path, files, cache, workers=None):
+    """
+    Map every duplicate among files to the first file with the same bytes.
+
+    files is a list of (relative path, size, mtime_ns) in preference order.
+    Only files sharing a size are hashed, first their start and then, for
+    the ones that still match, in full. Hashes of files whose size and
+    mtime did not change come from cache, and new ones are added to it.
+    """
+    by_size = {}
+    for path, size, mtime in files:
+        if size:
+            by_size.setdefault(size, []).append((path, size, mtime))
+    groups = [group for group in by_size.values() if len(group) > 1]
+
+    def cached(path, size, mtime):
+        entry = cache.get(path)
+        if entry is None or entry[0] != size or entry[1] != mtime:
+            entry = cache[path] = [size, mtime, None, None]
+        return entry
+
+    def hash_groups(executor, groups, slot, partial):
+        wanted = [(path, size) for group in groups for path, size, mtime in group
+                  if cached(path, size, mtime)[slot] is None]
+        digests = executor.map(lambda item: hash_file(os.path.join(folder_path, item[0]), item[1], partial),
+                               wanted)
+        for (path, size), digest in zip(wanted, digests):
+            cache[path][slot] = digest
+        matches = []
+        for group in groups:
+            by_hash = {}
+            for item in group:
+                by_hash.setdefault(cache[item[0]][slot], []).append(item)
+            matches.extend(match for match in by_hash.values() if len(match) > 1)
+        return matches
+
+    duplicates = {}
+    with ThreadPoolExecutor(max_workers=workers or default_workers()) as executor:
+        groups = hash_groups(executor, groups, 2, True)
+        for group in hash_groups(executor, groups, 3, False):
+            for path, size, mtime in group[1:]:
+                duplicates[path] = group[0][0]
+    return duplicates
+
+def scan_sorted(folder_path, dirs=CATEGORY_DIRS):
+    """Files an earlier run left directly in the category folders."""
+    for category in dirs:
+        try:
+            with os.scandir(os.path.join(folder_path, category)) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                yield entry
+
+def remove_empty_dirs(folder_path, dirs=CATEGORY_DIRS):
+    category_dirs = {os.path.join(folder_path, category) for category in dirs}
+    for root, dirs, files in os.walk(folder_path, topdown=False):
+        if root != folder_path and root not in category_dirs and not os.listdir(root):
+            os.rmdir(root)
+
+def remove_emptied_dirs(folder_path, emptied, dirs=CATEGORY_DIRS):
+    """
+    Remove the folders in emptied, relative to folder_path, and then their
+    parents, for as long as they are empty. Other empty folders are kept.
+    """
+    for directory in sorted(emptied, key=lambda path: path.count(os.sep), reverse=True):
+        while directory and directory not in dirs:
+            try:
+                os.rmdir(os.path.join(folder_path, directory))
+            except OSError:  # not empty, or gone already
+                break
+            directory = os.path.dirname(directory)
+
+def scan_folder(folder_path, skip=CATEGORY_DIRS):
+    """
+    Yield (folder, os.DirEntry) for every file under folder_path, in name
+    order. Folders named in skip at the top, by default the category
+    folders an earlier run sorted into, are left out. A folder that cannot
+    be read is reported and left out too.
+    """
+    stack = [folder_path]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Skipped {directory}: {e}")
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if directory != folder_path or entry.name not in skip:
+                    subdirs.append(entry.path)
+            else:
+                yield directory, entry
+        stack.extend(reversed(subdirs))
+
+def plan_folder(folder_path, unpack_archives=False, dedup=None, workers=None, sort_unpacked=False, paths=None,
+                categories=None):
+    """
+    Scan folder_path once and decide where every file goes, without
+    touching anything. With paths, a list of files and folders relative
+    to folder_path, only those files are planned, and only the folders
+    they leave empty are removed afterwards. categories defaults to
+    Categories.load().
+
+    With sort_unpacked, the files unpacked from archives are sorted by a
+    second plan once the first one is done.
 
+    With dedup set to 'drop' or 'link', a file with the same bytes as an
+    already sorted one, or one met earlier in the scan, is deleted or
+    becomes a hard link to it instead of being moved. With paths, only the
+    category folders those files go to are searched for sorted copies.
+    execute_plan checks a duplicate still matches before it goes.
+
+    The plan is a plain dict that save_plan() writes as JSON; paths in it
+    are relative to plan['root'].
+    """
+    folder_path = os.path.abspath(folder_path)
+    if categories is None:
+        categories = Categories.load()
+    registry = NameRegistry()
+    dirs = []
+    operations = []
+    unpacks = []
+    total_bytes = 0
+    def stat_all(entries):
+        return [(os.path.relpath(entry.path, folder_path), entry.stat(follow_symlinks=False))
+                for directory, entry in entries]
+
+    if paths is None:
+        files = stat_all(scan_folder(folder_path, categories.dirs))
+    else:
+        files = []
+        for path in paths:
+            full_path = os.path.join(folder_path, path)
+            if os.path.isdir(full_path):
+                files += stat_all(scan_folder(full_path, ()))
+                continue
+            try:
+                files.append((os.path.normpath(path), os.stat(full_path, follow_symlinks=False)))
+            except FileNotFoundError:
+                pass
+
+    file_categories = [categories.category(os.path.splitext(src)[1][1:].upper(), os.path.join(folder_path, src))
+                       for src, stat in files]
+    duplicates = {}
+    duplicate_bytes = 0
+    if dedup:
+        cache = load_hash_cache(folder_path)
+        loaded = {path: list(entry) for path, entry in cache.items()}
+        candidates = []
+        inodes = set()
+        searched = categories.dirs if paths is None else set(file_categories)
+        sorted_files = [(os.path.relpath(entry.path, folder_path), entry.stat())
+                        for entry in scan_sorted(folder_path, searched)]
+        for path, stat in sorted_files + files:
+            # hard links made by an earlier run are one file already
+            if (stat.st_dev, stat.st_ino) not in inodes:
+                inodes.add((stat.st_dev, stat.st_ino))
+                candidates.append((path, *entry_key(stat)))
+        duplicates = find_duplicate_files(folder_path, candidates, cache, workers)
+        # what the plan saw, a duplicate is checked against it before it goes
+        keys = {path: list(entry_key(stat)) for path, stat in sorted_files + files}
+
+    placed = {}
+    for (src, stat), category in zip(files, file_categories):
+        file_name, file_ext = os.path.splitext(os.path.basename(src))
+        file_ext = file_ext[1:].upper()
+        size = stat.st_size
+        total_bytes += size
+        keep = duplicates.get(src)
+        if keep is not None and dedup == 'drop':
+            duplicate_bytes += size
+            operations.append({'op': 'drop', 'src': src, 'keep': placed.get(keep, keep), 'size': size,
+                               'src_key': keys[src], 'keep_key': keys[keep]})
+            continue
+        if category not in dirs:
+            dirs.append(category)
+
+        target_dir = os.path.join(folder_path, category)
+        new_file_name = get_unique_name(target_dir, normalize(file_name),
+                                        '.' + file_ext.lower() if file_ext else '', registry)
+        dst = os.path.join(category, new_file_name)
+        placed[src] = dst
+        if keep is not None:
+            duplicate_bytes += size
+            operations.append({'op': 'link', 'src': src, 'dst': dst, 'keep': placed.get(keep, keep), 'size': size,
+                               'src_key': keys[src], 'keep_key': keys[keep]})
+            continue
+        operations.append({'op': 'move', 'src': src, 'dst': dst, 'size': size})
+        if category == 'archives' and unpack_archives:
+            unpack_folder = os.path.splitext(new_file_name)[0]
+            if not file_ext:
+                # sniffed, the archive itself has the name its folder would get
+                unpack_folder = get_unique_name(target_dir, new_file_name + '_unpacked', '', registry)
+            unpacks.append({'op': 'unpack', 'src': dst, 'dst': os.path.join(category, unpack_folder)})
+
+    hashes = None
+    if dedup:
+        # the hashes follow the files to where the plan puts them, a hard
+        # link shares the size and mtime of the file it keeps; those of
+        # category folders that were not searched are kept as they are.
+        # execute_plan saves them, planning writes nothing
+        kept = set(categories.dirs).difference(searched)
+        saved = {path: entry for path, entry in cache.items() if path.split(os.sep, 1)[0] in kept}
+        for path, size, mtime in candidates:
+            if path in cache and (path in placed or path not in duplicates):
+                saved[placed.get(path, path)] = cache[duplicates.get(path, path)]
+        if saved != loaded:
+            hashes = saved
+
+    return {
+        'version': PLAN_VERSION,
+        'root': folder_path,
+        'dirs': dirs,
+        'files': len(files),
+        'total_bytes': total_bytes,
+        'duplicates': sum(src in duplicates for src, stat in files),
+        'duplicate_bytes': duplicate_bytes,
+        'dedup': dedup,
+        'sort_unpacked': sort_unpacked,
+        'partial': paths is not None,
+        'categories': categories.rules,
+        'hashes': hashes,
+        'operations': operations + unpacks,
+    }
+
+def save_plan(plan, plan_path):
+    with open(plan_path, 'w', encoding='utf-8') as file:
+        json.dump(plan, file, ensure_ascii=False)
+
+def load_plan(plan_path):
+    with open(plan_path, 'r', encoding='utf-8') as file:
+        plan = json.load(file)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f"{plan_path} is not a version {PLAN_VERSION} sort plan")
+    return plan
+
+class Progress:
+    """Counts sorted files and prints the rate and time left now and then."""
+    def __init__(self, total_files):
+        self.total_files = total_files
+        self.files = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+        self._printed = self.started
+
+    def skip(self):
+        # done by an earlier run, counts toward the total but not the rate
+        self.files += 1
+        self.skipped += 1
+
+    def update(self):
+        self.files += 1
+        now = time.monotonic()
+        if now - self._printed >= PROGRESS_INTERVAL:
+            self._printed = now
+            print(self.status(now))
+
+    def status(self, now=None):
+        elapsed = max((now or time.monotonic()) - self.started, 1e-6)
+        rate = (self.files - self.skipped) / elapsed
+        status = f"Sorted {self.files}/{self.total_files} files, {rate:.0f} files/s"
+        if rate and self.files < self.total_files:
+            status += f", about {(self.total_files - self.files) / rate:.0f} s left"
+        return status
+
+def checkpoint_paths(folder_path):
+    base = state_path(folder_path, '.sort_checkpoint')
+    return base + '.json', base + '.log'
+
+def load_checkpoint(folder_path):
+    """
+    The plan of an interrupted sort of folder_path and the operations it
+    finished, as {index: target}, or None when there is nothing to resume.
+    """
+    plan_path, log_path = checkpoint_paths(folder_path)
+    if not os.path.exists(plan_path):
+        return None
+    plan = load_plan(plan_path)
+    done = {}
+    try:
+        with open(log_path, 'r', encoding='utf-8') as log:
+            for line in log:
+                # A line without its newline was cut off by the interruption.
+                if not line.endswith('\n'):
+                    break
+                index, separator, target = line[:-1].partition('\t')
+                if separator and index.isdigit():
+                    done[int(index)] = target
+    except FileNotFoundError:
+        pass
+    return plan, done
+
+def discard_checkpoint(folder_path):
+    for path in checkpoint_paths(folder_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+def execute_plan(plan, workers=None, done=None, checkpoint=True):
+    """
+    Carry out a plan made by plan_folder().
+
+    Moves run on a thread pool. Each archive is handed to a process pool
+    for unpacking as soon as it has been moved, so a big one does not hold
+    up the rest. Duplicates are dropped or linked after the moves, so the
+    copy they keep is already in place. A target name taken since the plan
+    was made is replaced with its next free variant.
+
+    Every finished operation is appended to a checkpoint log in
+    SORT_STATE_DIR, unless checkpoint is False or the log cannot be
+    written there. Pass done from load_checkpoint() to
+    pick up an interrupted run; the checkpoint is removed once everything
+    succeeded. Returns whether it did.
+    """
+    root = plan['root']
+    workers = workers or default_workers()
+    plan_path, log_path = checkpoint_paths(root)
+    resuming = done is not None
+    if checkpoint and not resuming:
+        try:
+            os.makedirs(SORT_STATE_DIR, exist_ok=True)
+            save_plan(plan, plan_path)
+        except OSError as e:
+            print(f"Warning: no checkpoint can be kept, an interrupted sort will not resume: {e}")
+            checkpoint = False
+    if not checkpoint:
+        log_path = os.devnull
+    done = done or {}
+    for category in plan['dirs']:
+        os.makedirs(os.path.join(root, category), exist_ok=True)
+
+    registry = NameRegistry()
+    progress = Progress(plan['files'])
+    moved = {}
+    unpacks = {}
+    unpacked = []
+    failed = []
+    emptied = set()  # folders files were taken out of
+    for index, operation in enumerate(plan['operations']):
+        if operation['op'] == 'unpack':
+            if index in done:
+                unpacked.append(operation['dst'])
+            else:
+                unpacks[operation['src']] = (index, operation)
+
+    unpack_workers = min(workers, os.cpu_count() or 1)
+    with open(log_path, 'a' if resuming else 'w', encoding='utf-8') as log, \
+            ThreadPoolExecutor(max_workers=workers) as movers, \
+            ProcessPoolExecutor(max_workers=unpack_workers) if unpacks else nullcontext() as unpackers:
+        def start_unpack(archive):
+            if archive in unpacks:
+                index, operation = unpacks.pop(archive)
+                src = os.path.join(root, moved.get(archive, archive))
+                if os.path.exists(src):
+                    future = unpackers.submit(unpack_to, src, os.path.join(root, operation['dst']))
+                    running[future] = (index, operation['dst'])
+
+        def finished(futures):
+            for future in futures:
+                index, target = running.pop(future)
+                operation = plan['operations'][index]
+                error = future.exception()
+                if isinstance(error, NOT_UNPACKABLE):
+                    print(f"Not unpacked: {error}")
+                elif isinstance(error, ChangedDuplicateError):
+                    print(f"Kept: {error}")
+                elif error is not None:
+                    print(f"Error: {error}")
+                    failed.append(index)
+                    continue
+                log.write(f"{index}\t{target}\n")
+                if operation['op'] == 'unpack':
+                    if error is None:
+                        unpacked.append(target)
+                else:
+                    progress.update()
+                    emptied.add(os.path.dirname(operation['src']))
+                    if operation['op'] == 'move':
+                        start_unpack(operation['dst'])
+            log.flush()
+
+        def claim(operation):
+            target_dir, file_name = os.path.split(operation['dst'])
+            dst = os.path.join(target_dir, registry.claim(os.path.join(root, target_dir), file_name))
+            moved[operation['dst']] = dst
+            return dst
+
+        running = {}
+        duplicates = []
+        for index, operation in enumerate(plan['operations']):
+            if operation['op'] == 'unpack':
+                continue
+            src = os.path.join(root, operation['src'])
+            if index in done or (resuming and not os.path.lexists(src)):
+                # done by the interrupted run
+                emptied.add(os.path.dirname(operation['src']))
+                if 'dst' in operation:
+                    moved[operation['dst']] = done.get(index, operation['dst'])
+                    start_unpack(operation['dst'])
+                progress.skip()
+                continue
+            if operation['op'] != 'move':
+                duplicates.append((index, operation))
+                continue
+            dst = claim(operation)
+            running[movers.submit(move_file, src, os.path.join(root, dst))] = (index, dst)
+            if len(running) >= workers * PENDING_MOVES_PER_WORKER:
+                finished(wait(running, return_when=FIRST_COMPLETED).done)
+
+        for index, operation in duplicates:
+            src = os.path.join(root, operation['src'])
+            keep = moved.get(operation['keep'], operation['keep'])
+            if operation['op'] == 'drop':
+                future = movers.submit(drop_duplicate, src, os.path.join(root, keep),
+                                       operation.get('src_key'), operation.get('keep_key'))
+                running[future] = (index, keep)
             else:
-                if not os.path.exists(os.path.join(folder_path, 'other')):
-                    os.mkdir(os.path.join(folder_path, 'other'))
-                new_file_name = get_unique_name(os.path.join(folder_path, 'other'), normalize(file_name), '.' + file_ext.lower())
-                shutil.move(new_path, os.path.join(folder_path, 'other', new_file_name))
+                dst = claim(operation)
+                future = movers.submit(link_duplicate, src, os.path.join(root, keep), os.path.join(root, dst),
+                                       operation.get('src_key'), operation.get('keep_key'))
+                running[future] = (index, dst)
+        while running:
+            finished(wait(running).done)
+
+    if plan.get('hashes') is not None:
+        # under the names the files really got
+        try:
+            save_hash_cache(root, {moved.get(path, path): entry for path, entry in plan['hashes'].items()})
+        except OSError as e:
+            print(f"Warning: the hashes of the sorted files were not saved: {e}")
+
+    print(progress.status())
+    categories = Categories(plan['categories']) if 'categories' in plan else DEFAULT_CATEGORIES
+    if plan.get('partial'):
+        remove_emptied_dirs(root, emptied, categories.dirs)
+    else:
+        remove_empty_dirs(root, categories.dirs)
+    if failed:
+        print(f"{len(failed)} operations failed, run the sort again to retry them.")
+    unpacked = [folder for folder in unpacked if os.path.isdir(os.path.join(root, folder))]
+    if plan.get('sort_unpacked') and unpacked:
+        # no checkpoint of its own, resuming this plan plans what is left in these folders again
+        print(f"Sorting the files unpacked from {len(unpacked)} archives.")
+        if not execute_plan(plan_folder(root, dedup=plan.get('dedup'), workers=workers, paths=unpacked,
+                                        categories=categories), workers, checkpoint=False):
+            failed.append(None)
+    if failed:
+        return False
+    if checkpoint:
+        discard_checkpoint(root)
+    return True
+
+def process_folder(folder_path, workers=None, unpack_archives=None, dedup=None, sort_unpacked=False):
+    """
+    Sort every file under folder_path into category folders.
+    """
+    if unpack_archives is None:
+        unpack_archives = input("Do you want to unpack archives? (yes/no): ").strip().lower() == 'yes'
+    execute_plan(plan_folder(folder_path, unpack_archives, dedup, workers, sort_unpacked), workers)
+
+class FolderWatcher:
+    """
+    Keeps folder_path sorted by planning only the files that arrive in it.
+
+    New paths come from watchdog when it is installed, otherwise from a
+    scan every WATCH_INTERVAL. A file is sorted once its size and mtime
+    stayed the same for settle seconds, so files still being written are
+    left alone.
+    """
+    def __init__(self, folder_path, unpack_archives=False, dedup=None, sort_unpacked=False, categories=None,
+                 workers=None, settle=SETTLE_SECONDS):
+        self.folder_path = os.path.abspath(folder_path)
+        self.unpack_archives = unpack_archives
+        self.dedup = dedup
+        self.sort_unpacked = sort_unpacked
+        self.categories = categories or Categories.load()
+        self.workers = workers
+        self.settle = settle
+        self.pending = {}  # relative path -> (size, mtime_ns, unchanged since)
+        self.failed = {}  # relative path -> (size, mtime_ns) it could not be sorted with
+        self._arrived = set()
+        self._lock = threading.Lock()
+
+    def notice(self, path):
+        """Note a path that was created, changed or moved into the folder."""
+        path = os.path.relpath(path, self.folder_path)
+        if path == os.curdir or path.startswith(os.pardir) or path.split(os.sep)[0] in self.categories.dirs:
+            return
+        if path.lower().endswith(PARTIAL_DOWNLOAD_EXTS):
+            return
+        with self._lock:
+            self._arrived.add(path)
+
+    def poll(self):
+        for directory, entry in scan_folder(self.folder_path, self.categories.dirs):
+            self.notice(entry.path)
 
-        for dir in dirs:
-            dir_path = os.path.join(root, dir)
-            if not os.listdir(dir_path):
-                os.rmdir(dir_path)
+    def ready(self, now=None):
+        """Take the paths that stopped changing off the pending list."""
+        now = now or time.monotonic()
+        with self._lock:
+            arrived, self._arrived = self._arrived, set()
+        for path in arrived:
+            self.pending.setdefault(path, None)
+
+        ready = []
+        for path, seen in list(self.pending.items()):
+            full_path = os.path.join(self.folder_path, path)
+            try:
+                stat = os.stat(full_path, follow_symlinks=False)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if S_ISDIR(stat.st_mode):
+                # a folder moved in at once brings no event for its files
+                del self.pending[path]
+                for directory, entry in scan_folder(full_path, ()):
+                    self.pending.setdefault(os.path.relpath(entry.path, self.folder_path), None)
+                continue
+            key = (stat.st_size, stat.st_mtime_ns)
+            if self.failed.get(path) == key:
+                del self.pending[path]
+            elif seen is None or seen[:2] != key:
+                self.pending[path] = (*key, now)
+            elif now - seen[2] >= self.settle:
+                del self.pending[path]
+                ready.append(path)
+        return ready
+
+    def sort(self, paths):
+        plan = plan_folder(self.folder_path, self.unpack_archives, self.dedup, self.workers, self.sort_unpacked,
+                           paths, self.categories)
+        if plan['operations']:
+            execute_plan(plan, self.workers)
+        for path in paths:
+            try:
+                stat = os.stat(os.path.join(self.folder_path, path), follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            # still here, so not retried until it changes
+            self.failed[path] = (stat.st_size, stat.st_mtime_ns)
+
+    def run(self, stop=None):
+        """Watch until Ctrl+C, or until stop, a threading.Event, is set."""
+        checkpoint = load_checkpoint(self.folder_path)
+        if checkpoint is not None:
+            plan, done = checkpoint
+            execute_plan(plan, self.workers, done)
+
+        observer = None
+        if Observer is not None:
+            observer = Observer()
+            observer.schedule(_WatchHandler(self), self.folder_path, recursive=True)
+            observer.start()
+        stop = stop or threading.Event()
+        try:
+            # what was already there, afterwards only what the events bring
+            self.poll()
+            while not stop.is_set():
+                ready = self.ready()
+                if ready:
+                    self.sort(ready)
+                stop.wait(WATCH_INTERVAL)
+                if observer is None:
+                    self.poll()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+class _WatchHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        # a move into the folder reports its new name as dest_path
+        self.watcher.notice(getattr(event, 'dest_path', '') or event.src_path)
+
+def watch_folder(folder_path, **options):
+    print(f"Watching {folder_path}, new files are sorted as they arrive. Press Ctrl+C to stop.")
+    FolderWatcher(folder_path, **options).run()
+
+def ask_dedup():
+    answer = input("Drop or hard link files that duplicate another one? (drop/link/no): ").strip().lower()
+    return answer if answer in DEDUP_MODES else None
 
 def clean_folder_interface():
-    folder_path = input("Enter the path to the folder you want to sort: ")
+    folder_path = input("Enter the path to the folder you want to sort (or a saved .json plan): ").strip()
+    if folder_path.lower().endswith('.json') and os.path.isfile(folder_path):
+        try:
+            plan = load_plan(folder_path)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            return
+        execute_plan(plan)
+        return
     if not folder_path or not os.path.exists(folder_path) or not os.path.isdir(folder_path):
         print("You did not enter the path to the folder!!!!")
-    else:
-        process_folder(folder_path)
+        return
+
+    checkpoint = load_checkpoint(folder_path)
+    if checkpoint is not None:
+        plan, done = checkpoint
+        answer = input(f"An unfinished sort of this folder did {len(done)} of {len(plan['operations'])} steps. "
+                       "Resume it? (yes/no): ").strip().lower()
+        if answer == 'yes':
+            execute_plan(plan, done=done)
+            return
+        discard_checkpoint(folder_path)
+
+    unpack_archives = input("Do you want to unpack archives? (yes/no): ").strip().lower() == 'yes'
+    sort_unpacked = unpack_archives and \
+        input("Sort the unpacked files into categories as well? (yes/no): ").strip().lower() == 'yes'
+    dedup = ask_dedup()
+    dry_run = input("Only save the plan, without moving anything? (yes/no): ").strip().lower() == 'yes'
+    try:
+        categories = Categories.load()
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return
+    plan = plan_folder(folder_path, unpack_archives, dedup, sort_unpacked=sort_unpacked, categories=categories)
+    print(f"{plan['files']} files ({plan['total_bytes']} bytes) to sort into {', '.join(plan['dirs']) or 'nothing'}.")
+    if plan['duplicates']:
+        print(f"{plan['duplicates']} of them are duplicates ({plan['duplicate_bytes']} bytes) "
+              f"and will be {'dropped' if dedup == 'drop' else 'hard linked'}.")
+    if dry_run:
+        plan_path = state_path(folder_path, '.sort_plan.json')
+        try:
+            os.makedirs(SORT_STATE_DIR, exist_ok=True)
+            save_plan(plan, plan_path)
+        except OSError as e:
+            print(f"Error: {e}")
+            return
+        print(f"Plan saved to {plan_path}. Enter its path at the sorter prompt to carry it out.")
+        return
+    execute_plan(plan)
+    if input("Keep watching the folder and sort new files as they arrive? (yes/no): ").strip().lower() == 'yes':
+        watch_folder(folder_path, unpack_archives=unpack_archives, dedup=dedup, sort_unpacked=sort_unpacked,
+                     categories=categories)
 
 if __name__ == "__main__":
-    clean_folder_interface()
+    multiprocessing.freeze_support()
+    if len(sys.argv) == 3 and sys.argv[1] == 'watch':
+        watch_folder(sys.argv[2])
+    else:
+        clean_folder_interface()
@@ -0,0 +1,317 @@
+"""
+Tests for address book records in the journal and the snapshot, the
+indexes, and import. The journal itself is tested in test_journal.py.
+
+    python -m pytest test_helper.py
+"""
+import contextlib
+import io
+import os
+import random
+import struct
+import tempfile
+import unittest
+
+import helper
+import journal
+
+
+def contact(name, phone='0501234567'):
+    record = helper.Record(name)
+    record.add_phone(phone)
+    return record
+
+
+class RecordTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.workdir.name, 'address_book.dat')
+        self.books = []
+        # the address book reports every load and save
+        self.quiet = contextlib.redirect_stdout(io.StringIO())
+        self.quiet.__enter__()
+
+    def tearDown(self):
+        for book in self.books:
+            book.close()
+        self.quiet.__exit__(None, None, None)
+        self.workdir.cleanup()
+
+    def open_book(self):
+        book = helper.AddressBook(self.filename)
+        book.read_from_file()
+        self.books.append(book)
+        return book
+
+    def save(self, *names):
+        book = self.open_book()
+        for name in names:
+            book.add_record(contact(name))
+        book.save_to_file()
+        book.close()
+
+    def names(self):
+        return sorted(self.open_book().data)
+
+    def append_to_journal(self, raw):
+        with open(self.filename + '.journal', 'ab') as file:
+            file.write(raw)
+
+    def test_changes_survive_reload(self):
+        self.save('a', 'b')
+        book = self.open_book()
+        book.delete('a')
+        book.edit_phone('b', '+380501234567', '0671234567')
+        book.save_to_file()
+        book.close()
+
+        book = self.open_book()
+        self.assertEqual(sorted(book.data), ['b'])
+        self.assertEqual([p.value for p in book.find('b').phones], ['+380671234567'])
+
+    def test_record_that_does_not_decode_is_cut(self):
+        self.save('a')
+        payload = struct.pack('<I', 5)  # five strings promised, none follow
+        self.append_to_journal(journal.frame(helper.JOURNAL_PUT, payload))
+        self.save('b')
+        self.assertEqual(self.names(), ['a', 'b'])
+
+    def test_compaction_keeps_every_contact(self):
+        self.save('a', 'b', 'c')
+        book = self.open_book()
+        book.delete('b')
+        book.save_to_file()
+        book.compact()
+        book.close()
+        self.assertFalse(os.path.exists(self.filename + '.journal'))
+        self.assertEqual(self.names(), ['a', 'c'])
+
+    def test_overlay_matches_a_dict(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            filename = os.path.join(workdir, 'book.dat')
+            names = [f'name{i}' for i in range(50)]
+            helper.write_columnar(filename, [(name, contact(name)) for name in names])
+            lazy = helper.LazyRecords(helper.ColumnarFile(filename))
+            expected = dict.fromkeys(names)
+            rng = random.Random(0)
+            for _ in range(300):
+                name = f'name{rng.randrange(70)}'
+                if rng.random() < 0.4:
+                    self.assertEqual(name in lazy, name in expected)
+                    if name in expected:
+                        del lazy[name], expected[name]
+                else:
+                    lazy[name] = contact(name)
+                    expected[name] = None
+                self.assertEqual(len(lazy), len(expected))
+            self.assertIsNone(lazy._slots)
+            self.assertEqual(list(lazy), list(expected))
+            lazy.close()
+
+
+class IndexTestCase(unittest.TestCase):
+    """A random book read back from its snapshot, for checking indexes against brute force."""
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.quiet = contextlib.redirect_stdout(io.StringIO())
+        self.quiet.__enter__()
+        self.rng = random.Random(0)
+        filename = os.path.join(self.workdir.name, 'address_book.dat')
+        book = helper.AddressBook(filename)
+        for _ in range(150):
+            book.add_record(self.random_contact())
+        book.save_to_file()
+        book.compact()
+        book.close()
+        self.book = helper.AddressBook(filename)
+        self.book.read_from_file()
+
+    def tearDown(self):
+        self.book.close()
+        self.quiet.__exit__(None, None, None)
+        self.workdir.cleanup()
+
+    def random_contact(self, name=None):
+        rng = self.rng
+        name = name or rng.choice(['anna', 'Anna', 'an', 'bohdan', 'olha', 'Олег']) + str(rng.randrange(60))
+        phones = [f'+38050{rng.randrange(10 ** 7):07d}' for _ in range(rng.randrange(3))]
+        emails = [f'{rng.choice(["anna", "bo", "olha"])}{rng.randrange(5)}@mail.com' for _ in range(rng.randrange(2))]
+        birthday = None
+        if rng.random() < 0.7:
+            birthday = f'{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.{rng.randrange(100):02d}'
+        return helper.Record.from_fields(name, phones, emails, birthday)
+
+    def mutate(self):
+        """Add, replace, delete or edit a random contact through the book."""
+        rng = self.rng
+        choice = rng.random()
+        if choice < 0.4:
+            self.book.add_record(self.random_contact())
+        elif choice < 0.7 and len(self.book.data):
+            self.book.delete(rng.choice(list(self.book.data)))
+        else:
+            name = rng.choice(list(self.book.data))
+            phones = self.book.find(name).phones
+            if phones:
+                self.book.edit_phone(name, phones[0].value, f'050{rng.randrange(10 ** 7):07d}')
+
+
+class SearchIndexTest(IndexTestCase):
+    def brute_search(self, query):
+        query = query.lower()
+        return [name for name, record in self.book.data.items()
+                if query in name.lower() or any(query in phone.value for phone in record.phones)]
+
+    def test_search_matches_a_scan(self):
+        queries = ['', 'a', 'an', 'ann', 'anna1', 'ол', 'олег', 'dan', '050', '0501', '+38050', 'zz']
+        for _ in range(200):
+            self.mutate()
+            query = self.rng.choice(queries + [str(self.rng.randrange(100))])
+            found = [record.name.get_value() for record in self.book.search(query)]
+            self.assertEqual(found, self.brute_search(query), query)
+
+
+class BirthdayIndexTest(IndexTestCase):
+    def brute_upcoming(self, days):
+        upcoming = []
+        for name, record in self.book.data.items():
+            days_left = record.birthday.days_to_birthday()
+            if days_left is not None and days_left <= days:
+                upcoming.append((days_left, name))
+        return [name for _, name in sorted(upcoming)]
+
+    def test_upcoming_birthdays_match_a_scan(self):
+        self.book.add_record(helper.Record.from_fields('leap', [], [], '29.02.92'))
+        for _ in range(100):
+            self.mutate()
+            days = self.rng.choice([0, 1, 7, 30, 200, 364, 365, 400])
+            found = [record.name.get_value() for record in self.book.upcoming_birthdays(days)]
+            self.assertEqual(found, self.brute_upcoming(days), days)
+
+
+class PagingTest(IndexTestCase):
+    def brute_order(self, sort):
+        if sort == 'added':
+            return list(self.book.data)
+        if sort == 'name':
+            return sorted(self.book.data)
+        today = helper._today_day()
+        calendar = []
+        no_birthday = []
+        for name, record in self.book.data.items():
+            birth_date = record.birthday.date
+            if birth_date is None:
+                no_birthday.append(name)
+            else:
+                day = helper._day_of_year(birth_date.month, birth_date.day)
+                calendar.append((day < today, day, name))
+        return [name for *_, name in sorted(calendar)] + sorted(no_birthday)
+
+    def test_pages_match_a_sort(self):
+        self.book.page_size = 7
+        for _ in range(30):
+            for _ in range(5):
+                self.mutate()
+            for sort in helper.PAGE_SORTS:
+                expected = self.brute_order(sort)
+                pages = self.book.get_total_pages(sort)
+                self.assertEqual(pages, (len(expected) + 6) // 7)
+                found = [record.name.get_value() for page in range(1, pages + 1)
+                         for record in self.book.get_page(page, sort)]
+                self.assertEqual(found, expected, sort)
+                self.assertEqual([record.name.get_value() for record in self.book.stream(sort)], expected)
+
+    def test_cursor_is_not_thrown_off_by_changes(self):
+        self.book.page_size = 7
+        added = 0
+        for sort in helper.PAGE_SORTS * 5:
+            seen = []
+            cursor = None
+            while True:
+                page, cursor = self.book.page_after(cursor, sort)
+                seen += [record.name.get_value() for record in page]
+                if cursor is None:
+                    break
+                # new names only, a contact moved to another place is not what cursors are about
+                if self.rng.random() < 0.5:
+                    self.book.delete(self.rng.choice(list(self.book.data)))
+                else:
+                    added += 1
+                    self.book.add_record(self.random_contact(f'new{added}'))
+            expected = self.brute_order(sort)
+            self.assertEqual(len(seen), len(set(seen)), sort)
+            self.assertEqual([name for name in seen if name in self.book.data],
+                             [name for name in expected if name in seen], sort)
+            self.assertFalse({name for name in expected if not name.startswith('new')} - set(seen), sort)
+
+
+class DuplicatesTest(IndexTestCase):
+    def brute_duplicates(self, max_block):
+        names = list(self.book.data)
+        keys = {name: helper._blocking_keys(self.book.data[name]) for name in names}
+        block_sizes = {}
+        for name in names:
+            for key in keys[name]:
+                block_sizes[key] = block_sizes.get(key, 0) + 1
+        groups = []
+        seen = set()
+        for name in names:
+            if name in seen:
+                continue
+            group = {name}
+            stack = [name]
+            while stack:
+                current = stack.pop()
+                for other in names:
+                    if other not in group and any(block_sizes[key] <= max_block
+                                                  for key in keys[current] & keys[other]):
+                        group.add(other)
+                        stack.append(other)
+            seen |= group
+            if len(group) > 1:
+                groups.append(group)
+        return groups
+
+    def test_groups_match_comparing_every_pair(self):
+        for max_block in (2, 5, helper.DEDUP_MAX_BLOCK):
+            for _ in range(10):
+                self.mutate()
+            order = {name: i for i, name in enumerate(self.book.data)}
+            found = self.book.find_duplicates(max_block)
+            self.assertCountEqual([set(group) for group in found], self.brute_duplicates(max_block))
+            self.assertEqual([len(group) for group in found], sorted(map(len, found), reverse=True))
+            for group in found:
+                self.assertEqual(group, sorted(group, key=order.__getitem__))
+
+
+class ImportTest(unittest.TestCase):
+    def import_file(self, name, content):
+        with tempfile.TemporaryDirectory() as workdir:
+            filename = os.path.join(workdir, name)
+            with open(filename, 'wb') as file:
+                file.write(content.encode('utf-8'))
+            book = helper.AddressBook(os.path.join(workdir, 'address_book.dat'))
+            with contextlib.redirect_stdout(io.StringIO()):
+                imported, errors = book.import_contacts(filename)
+            records = {name: [p.value for p in book.data[name].phones] for name in book.data}
+            book.close()
+        return imported, errors, records
+
+    def test_phones_that_are_not_strings_are_reported(self):
+        imported, errors, records = self.import_file('contacts.jsonl', (
+            '{"name": "a", "phones": 5}\n'
+            '{"name": "b", "phones": "0501234567; 0671234567"}\n'
+            '{"name": "c", "phones": ["0501234567"], "emails": [7]}\n'
+            '{"name": "d", "phones": ["0501234568"]}\n'))
+        self.assertEqual(imported, 2)
+        self.assertEqual(errors, [(1, "phones must be a list of strings"), (3, "emails must be a list of strings")])
+        self.assertEqual(records, {'b': ['+380501234567', '+380671234567'], 'd': ['+380501234568']})
+
+    def test_csv_with_byte_order_mark(self):
+        imported, errors, records = self.import_file('contacts.csv', '\ufeffname,phones\na,0501234567\n')
+        self.assertEqual((imported, errors), (1, []))
+        self.assertEqual(records, {'a': ['+380501234567']})
+
+
+if __name__ == '__main__':
+    unittest.main()
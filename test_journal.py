@@ -0,0 +1,188 @@
+"""
+Tests for the change log shared by the address book and the notebook:
+appending, crash recovery, freezing and compaction.
+
+    python -m pytest test_journal.py
+"""
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import journal
+
+MAGIC = b'TESTLOG1'
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.workdir.name, 'data')
+        self.log_filename = self.filename + '.log'
+        self.journals = []
+        self.output = io.StringIO()
+        self.quiet = contextlib.redirect_stdout(self.output)
+        self.quiet.__enter__()
+
+    def tearDown(self):
+        for log in self.journals:
+            log.wait()
+            log.close()
+        self.quiet.__exit__(None, None, None)
+        self.workdir.cleanup()
+
+    def open_journal(self):
+        log = journal.Journal(self.filename, self.log_filename, MAGIC)
+        self.journals.append(log)
+        return log
+
+    def append(self, *payloads):
+        log = self.open_journal()
+        log.append((1, payload) for payload in payloads)
+        log.close()
+
+    def replay(self):
+        """Payloads of the records replayed, refusing any that starts with b'bad'."""
+        payloads = []
+
+        def apply(operation, payload):
+            if bytes(payload).startswith(b'bad'):
+                raise ValueError('does not decode')
+            payloads.append((operation, bytes(payload)))
+
+        log = self.open_journal()
+        log.replay(apply)
+        return [payload for operation, payload in payloads], log
+
+    def append_raw(self, raw):
+        with open(self.log_filename, 'ab') as file:
+            file.write(raw)
+
+    def test_records_survive_reopening(self):
+        self.append(b'a', b'')
+        self.append(b'b')
+        payloads, log = self.replay()
+        self.assertEqual(payloads, [b'a', b'', b'b'])
+        self.assertEqual(log.records, 3)
+
+    def test_garbage_tail_is_cut_and_later_records_survive(self):
+        self.append(b'a')
+        self.append_raw(b'\x03\x00\x00\x00\x01garb')
+        self.replay()
+        self.append(b'b')
+        self.assertEqual(self.replay()[0], [b'a', b'b'])
+
+    def test_frame_cut_short_is_cut(self):
+        self.append(b'a')
+        self.append_raw(journal.frame(1, b'longer payload')[:-3])
+        self.assertEqual(self.replay()[0], [b'a'])
+        self.assertEqual(os.path.getsize(self.log_filename), len(MAGIC) + len(journal.frame(1, b'a')))
+
+    def test_frame_failing_its_checksum_is_cut_with_the_rest(self):
+        self.append(b'a', b'b', b'c')
+        with open(self.log_filename, 'r+b') as file:
+            file.seek(len(MAGIC) + len(journal.frame(1, b'a')) + journal.FRAME.size)
+            file.write(b'x')
+        self.assertEqual(self.replay()[0], [b'a'])
+
+    def test_frame_that_does_not_decode_is_cut_with_the_rest(self):
+        self.append(b'a', b'bad', b'c')
+        self.assertEqual(self.replay()[0], [b'a'])
+        self.append(b'd')
+        self.assertEqual(self.replay()[0], [b'a', b'd'])
+
+    def test_log_of_something_else_is_not_replayed(self):
+        self.append_raw(b'OTHERLOG' + journal.frame(1, b'a'))
+        self.assertEqual(self.replay()[0], [])
+        self.assertIn('not a log of', self.output.getvalue())
+
+    def test_frozen_log_is_replayed_first(self):
+        self.append(b'a')
+        log = self.open_journal()
+        log.freeze()
+        self.append(b'b')
+        self.assertEqual(self.replay()[0], [b'a', b'b'])
+
+    def test_freezing_twice_keeps_the_older_records_in_front(self):
+        self.append(b'a')
+        self.open_journal().freeze()
+        self.append(b'b')
+        self.open_journal().freeze()
+        self.append(b'c')
+        self.assertEqual(self.replay()[0], [b'a', b'b', b'c'])
+
+    def compact(self, finished=True, fail=False, background=False):
+        calls = []
+
+        def take_snapshot():
+            calls.append('snapshot')
+            return 'taken'
+
+        def write(snapshot):
+            calls.append(('write', snapshot))
+            if fail:
+                raise OSError('disk full')
+            return 'written'
+
+        def finish(written):
+            calls.append(('finish', written))
+            return finished
+
+        log = self.open_journal()
+        log.replay(lambda operation, payload: None)
+        log.compact(take_snapshot, write, finish, background)
+        return log, calls
+
+    def test_compaction_drops_the_frozen_log_once_finished(self):
+        self.append(b'a')
+        log, calls = self.compact()
+        self.assertEqual(calls, ['snapshot', ('write', 'taken'), ('finish', 'written')])
+        self.assertFalse(os.path.exists(log.frozen_filename))
+        self.assertFalse(os.path.exists(self.log_filename))
+        self.assertEqual(log.records, 0)
+
+    def test_compaction_that_did_not_finish_keeps_the_frozen_log(self):
+        self.append(b'a')
+        self.compact(finished=False)
+        self.append(b'b')
+        self.assertEqual(self.replay()[0], [b'a', b'b'])
+
+    def test_compaction_that_failed_to_write_keeps_the_frozen_log(self):
+        self.append(b'a')
+        log, calls = self.compact(fail=True)
+        self.assertNotIn(('finish', 'written'), calls)
+        self.assertIn('disk full', self.output.getvalue())
+        self.assertEqual(self.replay()[0], [b'a'])
+
+    def test_background_compaction_finishes_on_wait(self):
+        self.append(b'a')
+        log, calls = self.compact(background=True)
+        log.append([(1, b'b')])
+        log.wait()
+        self.assertEqual(calls[-1], ('finish', 'written'))
+        log.close()
+        self.assertEqual(self.replay()[0], [b'b'])
+
+    def test_compaction_is_due_once_the_log_is_as_big_as_the_data(self):
+        log = self.open_journal()
+        log.records = journal.COMPACT_MIN_RECORDS
+        self.assertTrue(log.should_compact(journal.COMPACT_MIN_RECORDS))
+        self.assertFalse(log.should_compact(journal.COMPACT_MIN_RECORDS + 1))
+        log.records = journal.COMPACT_MIN_RECORDS - 1
+        self.assertFalse(log.should_compact(0))
+
+
+class StringsTest(unittest.TestCase):
+    def test_strings_round_trip(self):
+        values = ['', 'a', None, 'кіт', 'x' * 1000]
+        packed = journal.pack_strings(values)
+        self.assertEqual(journal.unpack_strings(packed), (values, len(packed)))
+
+    def test_string_running_past_the_end_is_refused(self):
+        with self.assertRaises(ValueError):
+            journal.unpack_strings(journal.pack_strings(['abc'])[:-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+"""
+Tests for note records in the log and the segment, and the notebook
+indexes. The log itself is tested in test_journal.py.
+
+    python -m pytest test_note.py
+"""
+import contextlib
+import io
+import math
+import os
+import random
+import struct
+import tempfile
+import unittest
+from collections import Counter
+
+import journal
+import note
+
+
+class NotebookRecordTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.workdir.name, 'notes.db')
+        self.notebooks = []
+        self.quiet = contextlib.redirect_stdout(io.StringIO())
+        self.quiet.__enter__()
+
+    def tearDown(self):
+        for notebook in self.notebooks:
+            notebook.close()
+        self.quiet.__exit__(None, None, None)
+        self.workdir.cleanup()
+
+    def open_notebook(self):
+        notebook = note.Notebook(self.filename)
+        notebook.load_from_file(legacy_filename=os.path.join(self.workdir.name, 'notes.pkl'))
+        self.notebooks.append(notebook)
+        return notebook
+
+    def add(self, *titles):
+        notebook = self.open_notebook()
+        for title in titles:
+            notebook.add(title, f'text of {title}', ['tag'])
+        notebook.save_to_file()
+        notebook.close()
+
+    def titles(self):
+        return [n.title for n in self.open_notebook().notes.values()]
+
+    def append_to_log(self, raw):
+        with open(self.filename + '.log', 'ab') as file:
+            file.write(raw)
+
+    def test_note_that_does_not_decode_is_cut(self):
+        self.add('a')
+        self.append_to_log(journal.frame(note.LOG_PUT, struct.pack('<I', 9)))
+        self.add('b')
+        self.assertEqual(self.titles(), ['a', 'b'])
+
+    def test_compaction_keeps_texts_and_ids(self):
+        self.add('a', 'b', 'c')
+        notebook = self.open_notebook()
+        notebook.delete(2)
+        notebook.save_to_file()
+        notebook.compact()
+        self.assertFalse(os.path.exists(self.filename + '.log'))
+        notebook.close()
+        notebook = self.open_notebook()
+        self.assertEqual([(n.id, n.title, n.text) for n in notebook.notes.values()],
+                         [(1, 'a', 'text of a'), (3, 'c', 'text of c')])
+        self.assertEqual(notebook.add('d', '').id, 4)
+
+
+WORDS = ['apple', 'applied', 'apply', 'banana', 'band', 'cat', 'catalog', 'кіт', 'кітель', 'note']
+TAGS = ['work', 'home', 'todo', 'ideas']
+
+
+class IndexTestCase(unittest.TestCase):
+    """A random notebook read back from its segment, for checking indexes against brute force."""
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.workdir.name, 'notes.db')
+        self.quiet = contextlib.redirect_stdout(io.StringIO())
+        self.quiet.__enter__()
+        self.rng = random.Random(0)
+        notebook = self.open_notebook()
+        for _ in range(80):
+            notebook.add(*self.random_fields())
+        notebook.save_to_file()
+        notebook.compact()
+        notebook.close()
+        self.notebook = self.open_notebook()
+
+    def tearDown(self):
+        self.notebook.close()
+        self.quiet.__exit__(None, None, None)
+        self.workdir.cleanup()
+
+    def open_notebook(self):
+        notebook = note.Notebook(self.filename)
+        notebook.load_from_file(legacy_filename=os.path.join(self.workdir.name, 'notes.pkl'))
+        return notebook
+
+    def words(self, low, high):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(low, high)))
+
+    def random_fields(self):
+        return self.words(1, 3), self.words(0, 12), self.rng.sample(TAGS, self.rng.randrange(3))
+
+    def mutate(self):
+        """Add, delete, edit or tag a random note through the notebook."""
+        rng = self.rng
+        notebook = self.notebook
+        choice = rng.random()
+        if choice < 0.3 or not notebook.notes:
+            notebook.add(*self.random_fields())
+        elif choice < 0.5:
+            notebook.delete(rng.choice(list(notebook.notes)))
+        elif choice < 0.8:
+            title, text, tags = self.random_fields()
+            notebook.edit(rng.choice(list(notebook.notes)), title, text, tags)
+        else:
+            notebook.add_tag(rng.choice(list(notebook.notes)), rng.choice(TAGS))
+
+
+class SearchIndexTest(IndexTestCase):
+    def brute_scores(self, query, prefix):
+        counts = {note_id: Counter(note._note_tokens(n)) for note_id, n in self.notebook.notes.items()}
+        vocabulary = set().union(*counts.values())
+        average_length = sum(sum(c.values()) for c in counts.values()) / len(counts)
+
+        def score(term, note_id):
+            frequency = counts[note_id][term]
+            having = sum(term in c for c in counts.values())
+            idf = math.log(1 + (len(counts) - having + 0.5) / (having + 0.5))
+            length_ratio = sum(counts[note_id].values()) / average_length
+            return idf * frequency * (note.BM25_K1 + 1) / (
+                frequency + note.BM25_K1 * (1 - note.BM25_B + note.BM25_B * length_ratio))
+
+        scores = {}
+        for group in note._parse_query(query):
+            words = [[word for word in vocabulary if word == term or (prefix or is_prefix) and word.startswith(term)]
+                     for term, is_prefix in group]
+            for note_id, c in counts.items():
+                if all(any(word in c for word in terms) for terms in words):
+                    total = sum(score(word, note_id) for terms in words for word in terms if word in c)
+                    scores[note_id] = max(scores.get(note_id, -1), total)
+        return scores
+
+    def test_search_matches_scoring_every_note(self):
+        queries = ['apple', 'app', 'app*', 'apple band', 'cat OR ban', 'кіт AND note', 'Кіт*', 'apply OR',
+                   'work', 'missing', 'cat catalog OR apple']
+        for _ in range(150):
+            self.mutate()
+            query = self.rng.choice(queries)
+            prefix = self.rng.random() < 0.5
+            found = [n.id for n in self.notebook.search(query, prefix)]
+            scores = self.brute_scores(query, prefix)
+            self.assertCountEqual(found, scores, query)
+            for better, worse in zip(found, found[1:]):
+                self.assertGreater(scores[better], scores[worse] - 1e-9, query)
+
+
+class TagIndexTest(IndexTestCase):
+    def test_tag_queries_match_a_scan(self):
+        for _ in range(150):
+            self.mutate()
+            notes = sorted(self.notebook.notes.values(), key=lambda n: n.id)
+            tags = self.rng.sample(TAGS + ['unused'], self.rng.randint(1, 3))
+            self.assertEqual([n.id for n in self.notebook.tagged(tags)],
+                             [n.id for n in notes if all(tag in n.tags for tag in tags)])
+            self.assertEqual([n.id for n in self.notebook.tagged(tags, match_all=False)],
+                             [n.id for n in notes if any(tag in n.tags for tag in tags)])
+            counts = Counter(tag for n in notes for tag in set(n.tags))
+            self.assertEqual(self.notebook.tag_counts(), sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+            self.assertCountEqual(self.notebook.list_tags(), counts)
+
+
+class NoteIdTest(IndexTestCase):
+    def contents(self):
+        return [(n.id, n.title, n.text, list(n.tags)) for n in self.notebook.notes.values()]
+
+    def test_ids_are_never_reused_across_saves_and_reloads(self):
+        issued = max(self.notebook.notes)
+        for step in range(200):
+            self.mutate()
+            if self.notebook.notes:
+                self.assertLessEqual(max(self.notebook.notes), self.notebook._next_id - 1)
+            new = self.notebook.add(*self.random_fields())
+            self.assertGreater(new.id, issued)
+            issued = new.id
+            ids = list(self.notebook.notes)
+            self.assertEqual(ids, sorted(ids))
+            for note_id in ids:
+                self.assertEqual(self.notebook.get(note_id).id, note_id)
+            if step % 20 == 19:
+                expected = self.contents()
+                self.notebook.save_to_file()
+                if step % 40 == 39:
+                    self.notebook.compact()
+                self.notebook.close()
+                self.notebook = self.open_notebook()
+                self.assertEqual(self.contents(), expected)
+        self.notebook.clear_all()
+        self.notebook.save_to_file()
+        self.notebook.close()
+        self.notebook = self.open_notebook()
+        self.assertEqual(self.notebook.notes, {})
+        self.assertGreater(self.notebook.add('after clearing', '').id, issued)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""
+Tests for archive unpacking limits, duplicates, checkpoints, pruning and
+target names of the sorter.
+
+    python -m pytest test_sort.py
+"""
+import contextlib
+import io
+import os
+import random
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+import sort
+
+
+class SortTestCase(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.workdir.name, 'folder')
+        os.mkdir(self.folder)
+        # checkpoints and hash caches stay out of the home folder
+        state = mock.patch.object(sort, 'SORT_STATE_DIR', os.path.join(self.workdir.name, 'state'))
+        state.start()
+        self.addCleanup(state.stop)
+        self.quiet = contextlib.redirect_stdout(io.StringIO())
+        self.quiet.__enter__()
+
+    def tearDown(self):
+        self.quiet.__exit__(None, None, None)
+        self.workdir.cleanup()
+
+    def write(self, path, content='text'):
+        path = os.path.join(self.folder, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def files(self):
+        return sorted(os.path.relpath(os.path.join(root, name), self.folder)
+                      for root, dirs, names in os.walk(self.folder) for name in names)
+
+
+class UnpackTest(SortTestCase):
+    def make_zip(self, members):
+        archive_path = os.path.join(self.workdir.name, 'archive.zip')
+        with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, content in members:
+                archive.writestr(name, content)
+        return archive_path
+
+    def test_member_outside_the_folder_is_refused(self):
+        archive_path = self.make_zip([('inside.txt', 'a'), ('../outside.txt', 'b')])
+        target = os.path.join(self.folder, 'archive')
+        with self.assertRaises(sort.UnsafeArchiveError):
+            sort.unpack_to(archive_path, target)
+        self.assertFalse(os.path.exists(target))
+        self.assertFalse(os.path.exists(os.path.join(self.folder, 'outside.txt')))
+
+    def test_archive_unpacking_past_its_ratio_is_refused(self):
+        archive_path = self.make_zip([('zeros.bin', bytes(100000))])
+        target = os.path.join(self.folder, 'archive')
+        with mock.patch.object(sort, 'MIN_UNPACK_LIMIT', 0), mock.patch.object(sort, 'MAX_UNPACK_RATIO', 10):
+            with self.assertRaises(sort.UnsafeArchiveError):
+                sort.unpack_to(archive_path, target)
+        self.assertFalse(os.path.exists(target))
+
+    def test_archive_unpacking_past_the_size_limit_is_refused(self):
+        archive_path = self.make_zip([('a.bin', bytes(600)), ('b.bin', bytes(600))])
+        with mock.patch.object(sort, 'MAX_UNPACKED_BYTES', 1000):
+            with self.assertRaises(sort.UnsafeArchiveError):
+                sort.unpack_to(archive_path, os.path.join(self.folder, 'archive'))
+
+    def test_archive_with_too_many_members_is_refused(self):
+        archive_path = self.make_zip([(f'{i}.txt', 'x') for i in range(5)])
+        with mock.patch.object(sort, 'MAX_ARCHIVE_MEMBERS', 4):
+            with self.assertRaises(sort.UnsafeArchiveError):
+                sort.unpack_to(archive_path, os.path.join(self.folder, 'archive'))
+
+    def test_archive_within_the_limits_is_unpacked(self):
+        archive_path = self.make_zip([('dir/a.txt', 'a'), ('b.txt', 'b')])
+        target = os.path.join(self.folder, 'archive')
+        sort.unpack_to(archive_path, target)
+        self.assertEqual(self.files(), ['archive/b.txt', 'archive/dir/a.txt'])
+
+
+class DuplicateTest(SortTestCase):
+    def sort(self, dedup):
+        self.write('documents/sorted.txt', 'same')
+        self.write('a.txt', 'same')
+        self.write('new/b.txt', 'same')
+        self.write('c.txt', 'other')
+        plan = sort.plan_folder(self.folder, dedup=dedup)
+        self.assertEqual(plan['duplicates'], 2)
+        self.assertTrue(sort.execute_plan(plan))
+
+    def test_drop_keeps_the_sorted_copy(self):
+        self.sort('drop')
+        self.assertEqual(self.files(), ['documents/c.txt', 'documents/sorted.txt'])
+
+    def test_link_points_every_copy_at_the_sorted_one(self):
+        self.sort('link')
+        self.assertEqual(self.files(), ['documents/a.txt', 'documents/b.txt', 'documents/c.txt',
+                                        'documents/sorted.txt'])
+        inode = os.stat(os.path.join(self.folder, 'documents', 'sorted.txt')).st_ino
+        for name in ('a.txt', 'b.txt'):
+            self.assertEqual(os.stat(os.path.join(self.folder, 'documents', name)).st_ino, inode)
+
+    def test_copy_changed_after_planning_is_kept(self):
+        self.write('a.txt', 'same')
+        self.write('b.txt', 'same')
+        plan = sort.plan_folder(self.folder, dedup='drop')
+        self.write('a.txt', 'changed')
+        sort.execute_plan(plan)
+        self.assertEqual(self.files(), ['b.txt', 'documents/a.txt'])
+
+
+class CheckpointTest(SortTestCase):
+    def test_interrupted_sort_resumes_where_it_stopped(self):
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            self.write(name)
+        plan = sort.plan_folder(self.folder)
+        move_file = sort.move_file
+
+        def failing_move(src, dst):
+            if src.endswith('b.txt'):
+                raise OSError('interrupted')
+            return move_file(src, dst)
+
+        with mock.patch.object(sort, 'move_file', failing_move):
+            self.assertFalse(sort.execute_plan(plan))
+        plan, done = sort.load_checkpoint(self.folder)
+        self.assertEqual(sorted(done.values()), ['documents/a.txt', 'documents/c.txt'])
+
+        self.assertTrue(sort.execute_plan(plan, done=done))
+        self.assertEqual(self.files(), ['documents/a.txt', 'documents/b.txt', 'documents/c.txt'])
+        self.assertIsNone(sort.load_checkpoint(self.folder))
+
+
+class PruneTest(SortTestCase):
+    def test_partial_plan_removes_only_the_folders_it_emptied(self):
+        self.write('incoming/batch/a.txt')
+        os.makedirs(os.path.join(self.folder, 'empty'))
+        os.makedirs(os.path.join(self.folder, 'incoming', 'also_empty'))
+        plan = sort.plan_folder(self.folder, paths=[os.path.join('incoming', 'batch')])
+        self.assertTrue(sort.execute_plan(plan))
+        self.assertEqual(self.files(), ['documents/a.txt'])
+        self.assertTrue(os.path.isdir(os.path.join(self.folder, 'empty')))
+        self.assertTrue(os.path.isdir(os.path.join(self.folder, 'incoming', 'also_empty')))
+        self.assertFalse(os.path.exists(os.path.join(self.folder, 'incoming', 'batch')))
+
+
+class NameRegistryTest(SortTestCase):
+    def test_unique_names_match_probing_the_disk(self):
+        rng = random.Random(0)
+        names = ['a', 'a_1', 'b', 'b_2', 'c']
+        exts = ['', '.txt', '.TXT']
+        for _ in range(10):
+            self.write(rng.choice(names) + rng.choice(exts))
+        registry = sort.NameRegistry()
+        for _ in range(200):
+            name, ext = rng.choice(names), rng.choice(exts)
+            expected = sort.get_unique_name(self.folder, name, ext)
+            self.assertEqual(registry.unique_name(self.folder, name, ext), expected)
+            self.write(expected)
+
+
+if __name__ == '__main__':
+    unittest.main()